@@ -5,30 +5,121 @@ Complete Flask application with all features
 
 # PART 1: APP INITIALIZATION & CONFIGURATION
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_cors import CORS
+from flask_socketio import SocketIO, join_room
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from werkzeug.datastructures import MultiDict
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from contextlib import contextmanager
+import click
+from collections import OrderedDict
 import os
+import sys
 import json
+import hashlib
+import hmac
+import urllib.request
+import urllib.error
+import tempfile
+import re
 import secrets
-from io import BytesIO
+import uuid
+import base64
+import gzip
+import zlib
+import time
+import threading
+import platform
+from io import StringIO, TextIOWrapper
 import csv
+import sqlite3
+
+def database_uri():
+    """Database URL from the environment, defaulting to the local SQLite file"""
+    uri = os.environ.get('DATABASE_URL', 'sqlite:///vendor_app.db')
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def database_engine_options(uri):
+    """Engine/pool settings for the configured backend"""
+    if uri.startswith('sqlite'):
+        # SQLite pragmas are applied per connection in set_sqlite_pragmas
+        return {}
+    
+    # Every worker process owns its own pool, so the database must accept
+    # workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections in total;
+    # e.g. 4 gunicorn workers with the defaults need up to 4 * (5 + 10) = 60.
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),  # seconds
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # seconds
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    }
+
 
 # Create Flask app first
 app = Flask(__name__)
-app.config['SECRET_KEY'] = secrets.token_hex(32)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///vendor_app.db'
+# Set SECRET_KEY in production so sessions survive restarts and are shared by all workers
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # milliseconds
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')  # NORMAL is durable enough under WAL
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['PAYMENT_PROVIDER_URL'] = os.environ.get('PAYMENT_PROVIDER_URL', 'http://127.0.0.1:5055')  # `flask payment-simulator` default
+app.config['PAYMENT_PROVIDER_TIMEOUT'] = float(os.environ.get('PAYMENT_PROVIDER_TIMEOUT', 10))  # seconds per attempt
+app.config['PAYMENT_MAX_ATTEMPTS'] = int(os.environ.get('PAYMENT_MAX_ATTEMPTS', 3))
+app.config['PAYMENT_RETRY_BACKOFF'] = float(os.environ.get('PAYMENT_RETRY_BACKOFF', 2))  # seconds, doubled per retry
+app.config['PAYMENT_EXPIRY'] = int(os.environ.get('PAYMENT_EXPIRY', 300))  # seconds a payment may stay pending
+app.config['PAYMENT_CALLBACK_SECRET'] = os.environ.get('PAYMENT_CALLBACK_SECRET')
+app.config['METRIC_SHARDS'] = int(os.environ.get('METRIC_SHARDS', 16))  # rows per platform metric, spreading write locks
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # in-process job threads; 0 when running `flask worker`
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1))  # seconds
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+app.config['JOB_RETRY_BACKOFF'] = float(os.environ.get('JOB_RETRY_BACKOFF', 5))  # seconds, doubled per retry
+app.config['JOB_LOCK_TIMEOUT'] = int(os.environ.get('JOB_LOCK_TIMEOUT', 600))  # seconds without a heartbeat before a running job is presumed dead
+app.config['JOB_RETENTION_DAYS'] = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+app.config['EXPIRY_ALERT_DAYS'] = int(os.environ.get('EXPIRY_ALERT_DAYS', 7))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 10000))
+app.config['USER_CACHE_REDIS_URL'] = os.environ.get('USER_CACHE_REDIS_URL')
+app.config['ANALYTICS_CACHE_TTL'] = int(os.environ.get('ANALYTICS_CACHE_TTL', 60))  # seconds; sales invalidate sooner, in every process
+app.config['ANALYTICS_CACHE_SIZE'] = int(os.environ.get('ANALYTICS_CACHE_SIZE', 1000))
+app.config['CATALOG_CACHE_TTL'] = int(os.environ.get('CATALOG_CACHE_TTL', 3600))  # seconds; entries are also version-checked
+app.config['CATALOG_CACHE_SIZE'] = int(os.environ.get('CATALOG_CACHE_SIZE', 1000))
 
 # Initialize extensions
 db = SQLAlchemy(app)
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the single writer; busy_timeout makes writers queue instead of failing"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+    if app.config['SQLITE_SYNCHRONOUS'].upper() in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS'].upper()}")
+    cursor.close()
+
 CORS(app)
+socketio = SocketIO(app, message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -36,6 +127,7 @@ login_manager.login_view = 'login'
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (db.Index('ix_users_created_at', 'created_at'),)
     id = db.Column(db.Integer, primary_key=True)
     phone = db.Column(db.String(20), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
@@ -58,6 +150,7 @@ class User(UserMixin, db.Model):
 
 class Shop(db.Model):
     __tablename__ = 'shops'
+    __table_args__ = (db.Index('ix_shops_owner_id', 'owner_id'),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     category = db.Column(db.String(50))
@@ -66,12 +159,23 @@ class Shop(db.Model):
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    change_version = db.Column(db.BigInteger, index=True)
+    image_hash = db.Column(db.String(64), db.ForeignKey('image_assets.content_hash'))
     
     products = db.relationship('Product', backref='shop', lazy=True, cascade='all, delete-orphan')
     sales = db.relationship('Sale', backref='shop', lazy=True)
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_shop_active', 'shop_id', 'is_active'),
+        db.Index('ix_products_shop_created', 'shop_id', 'created_at'),
+        db.Index('ix_products_shop_units_sold', 'shop_id', 'units_sold'),
+        db.Index('ix_products_units_sold', 'units_sold'),
+        db.Index('uq_products_shop_sku', 'shop_id', 'sku', unique=True),
+        db.Index('ix_products_shop_barcode', 'shop_id', 'barcode', 'is_active'),
+        db.Index('ix_products_shop_change_version', 'shop_id', 'change_version'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
@@ -88,11 +192,23 @@ class Product(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    change_version = db.Column(db.BigInteger, index=True)
+    units_sold = db.Column(db.Integer, default=0)
+    revenue = db.Column(db.Float, default=0)
+    image_hash = db.Column(db.String(64), db.ForeignKey('image_assets.content_hash'))
     
     sale_items = db.relationship('SaleItem', backref='product', lazy=True)
 
+# Case-insensitive name prefix search (see search_products)
+db.Index('ix_products_shop_name_lower', Product.shop_id, db.func.lower(Product.name))
+
 class Sale(db.Model):
     __tablename__ = 'sales'
+    __table_args__ = (
+        db.Index('ix_sales_shop_created', 'shop_id', 'created_at'),
+        db.Index('ix_sales_created_at', 'created_at'),
+        db.Index('ix_sales_status_created', 'status', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sale_number = db.Column(db.String(50), unique=True, nullable=False)
     shop_id = db.Column(db.Integer, db.ForeignKey('shops.id'), nullable=False)
@@ -109,6 +225,10 @@ class Sale(db.Model):
 
 class SaleItem(db.Model):
     __tablename__ = 'sale_items'
+    __table_args__ = (
+        db.Index('ix_sale_items_sale_id', 'sale_id'),
+        db.Index('ix_sale_items_product_id', 'product_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sales.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -118,6 +238,7 @@ class SaleItem(db.Model):
 
 class Expense(db.Model):
     __tablename__ = 'expenses'
+    __table_args__ = (db.Index('ix_expenses_user_date', 'user_id', 'date'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     category = db.Column(db.String(100), nullable=False)
@@ -145,6 +266,7 @@ class Supplier(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (db.Index('ix_orders_buyer_created', 'buyer_id', 'created_at'),)
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
     buyer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -159,6 +281,7 @@ class Order(db.Model):
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
+    __table_args__ = (db.Index('ix_order_items_order_id', 'order_id'),)
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
     product_name = db.Column(db.String(200), nullable=False)
@@ -168,11 +291,17 @@ class OrderItem(db.Model):
 
 class Alert(db.Model):
     __tablename__ = 'alerts'
+    __table_args__ = (
+        db.Index('ix_alerts_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_alerts_user_created', 'user_id', 'created_at'),
+        db.Index('ix_alerts_product_user_unread', 'product_id', 'user_id', 'alert_type', 'is_read'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     message = db.Column(db.Text, nullable=False)
     alert_type = db.Column(db.String(50))
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), index=True)
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -183,51 +312,692 @@ class SyncLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     sync_type = db.Column(db.String(50))
+    client_id = db.Column(db.String(36), unique=True)
+    record_id = db.Column(db.Integer)
     data = db.Column(db.Text)
     status = db.Column(db.String(20), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     synced_at = db.Column(db.DateTime)
+
+class ShopDailySales(db.Model):
+    __tablename__ = 'shop_daily_sales'
+    __table_args__ = (
+        db.UniqueConstraint('shop_id', 'day', name='uq_shop_daily_sales_shop_day'),
+        db.Index('ix_shop_daily_sales_day', 'day'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    shop_id = db.Column(db.Integer, db.ForeignKey('shops.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductDailySales(db.Model):
+    __tablename__ = 'product_daily_sales'
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'day', name='uq_product_daily_sales_product_day'),
+        db.Index('ix_product_daily_sales_shop_day', 'shop_id', 'day'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    shop_id = db.Column(db.Integer, db.ForeignKey('shops.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    units_sold = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class PlatformMetric(db.Model):
+    __tablename__ = 'platform_metrics'
+    __table_args__ = (db.UniqueConstraint('name', 'period', 'shard', name='uq_platform_metrics_name_period_shard'),)
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    period = db.Column(db.String(7), nullable=False, default='all')  # 'all' or 'YYYY-MM'
+    shard = db.Column(db.Integer, nullable=False, default=0)  # a metric's value is the sum over its shards
+    value = db.Column(db.Float, nullable=False, default=0)
+
+class Payment(db.Model):
+    __tablename__ = 'payments'
+    __table_args__ = (db.Index('ix_payments_status_expires', 'status', 'expires_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    reference = db.Column(db.String(50), unique=True, nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sales.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    provider = db.Column(db.String(20), nullable=False)  # mpesa, tigopesa, airtel_money
+    phone = db.Column(db.String(20), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, confirmed, failed, expired
+    provider_reference = db.Column(db.String(100))
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        db.Index('ix_jobs_finished_at', 'finished_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)  # JSON keyword arguments
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    unique_key = db.Column(db.String(100), unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class ImageAsset(db.Model):
+    __tablename__ = 'image_assets'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of the original
+    extension = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='pending')  # pending, ready, failed
+    uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SyncVersion(db.Model):
+    __tablename__ = 'sync_versions'
+    id = db.Column(db.Integer, primary_key=True)  # owner user id: one delta-sync counter per vendor
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class MonotonicIdGenerator:
+    """ULID-style ids: 48-bit millisecond time + 80-bit random tail, monotonic within a process"""
     
-def init_db():
-    """Initialize database with tables and default data"""
-    print("🔧 Initializing database...")
+    ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # Crockford base32
+    RANDOM_BITS = 80
     
-    # Remove existing database to start fresh
-    if os.path.exists('vendor_app.db'):
-        os.remove('vendor_app.db')
-        print("🗑️ Removed existing database file")
+    def __init__(self):
+        self._reseed()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reseed)
     
-    # Create all tables
-    db.create_all()
-    print("✅ Database tables created successfully!")
+    def _reseed(self):
+        # A forked worker must not continue its parent's sequence, nor inherit a lock
+        # that another thread (e.g. a job worker) held at fork time
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._last_random = 0
     
-    # Create admin user
-    admin = User(
-        phone='admin',
-        name='Administrator',
-        email='admin@vendorapp.com',
-        role='admin'
+    def next_id(self):
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._last_random = secrets.randbits(self.RANDOM_BITS)
+            else:
+                # Same millisecond (or clock stepped back): stay sortable by incrementing the tail
+                self._last_random += 1
+                if self._last_random >> self.RANDOM_BITS:
+                    self._last_ms += 1
+                    self._last_random = secrets.randbits(self.RANDOM_BITS)
+            value = (self._last_ms << self.RANDOM_BITS) | self._last_random
+        
+        chars = []
+        for _ in range(26):
+            chars.append(self.ALPHABET[value & 31])
+            value >>= 5
+        return ''.join(reversed(chars))
+
+
+id_generator = MonotonicIdGenerator()
+
+
+def generate_number(prefix):
+    """Mint a unique, time-sortable business number such as SALE01J9..."""
+    return f"{prefix}{id_generator.next_id()}"
+
+
+JOB_TASKS = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a job that must not be retried"""
+
+
+def job_task(name, attempts_config='JOB_MAX_ATTEMPTS', backoff_config='JOB_RETRY_BACKOFF', on_failure=None):
+    """Register fn as a background job; on_failure(error, **payload) runs once retries are exhausted"""
+    def decorator(fn):
+        JOB_TASKS[name] = {
+            'fn': fn,
+            'attempts_config': attempts_config,
+            'backoff_config': backoff_config,
+            'on_failure': on_failure
+        }
+        return fn
+    return decorator
+
+
+def enqueue_job(name, payload=None, user_id=None, run_at=None):
+    """Queue a job in the current transaction; it becomes visible to workers on commit"""
+    job = Job(
+        name=name,
+        payload=json.dumps(payload or {}),
+        user_id=user_id,
+        run_at=run_at or datetime.utcnow(),
+        max_attempts=app.config[JOB_TASKS[name]['attempts_config']]
     )
-    admin.set_password('admin123')
-    db.session.add(admin)
+    db.session.add(job)
+    start_job_workers()
+    return job
+
+
+def enqueue_unique_job(name, unique_key, payload=None, user_id=None, run_at=None):
+    """Queue a job unless one with the same unique_key exists; returns whether it was queued"""
+    row = {
+        'name': name,
+        'payload': json.dumps(payload or {}),
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': app.config[JOB_TASKS[name]['attempts_config']],
+        'unique_key': unique_key,
+        'user_id': user_id,
+        'run_at': run_at or datetime.utcnow(),
+        'created_at': datetime.utcnow()
+    }
+    stmt = upsert_insert(Job.__table__)
+    
+    if stmt is not None:
+        result = db.session.execute(stmt.on_conflict_do_nothing(index_elements=['unique_key']), [row])
+        queued = result.rowcount == 1
+    else:
+        queued = Job.query.filter_by(unique_key=unique_key).first() is None
+        if queued:
+            db.session.execute(Job.__table__.insert(), [row])
+    
+    start_job_workers()
+    return queued
+
+
+def next_change_version(owner_id, connection=None):
+    """Bump and return a vendor's change counter used for delta sync cursors"""
+    connection = connection or db.session.connection()
+    table = SyncVersion.__table__
+    
+    # One counter row per vendor (id = owner user id); the row update locks only that vendor's
+    # counter until commit, so their versions follow commit order without serializing other vendors
+    result = connection.execute(table.update().where(table.c.id == owner_id).values(value=table.c.value + 1))
+    if not result.rowcount:
+        # Start above every existing counter so cursors issued before this vendor had a row stay valid
+        connection.execute(table.insert().from_select(['id', 'value'], db.select(
+            db.literal(owner_id), db.func.coalesce(db.func.max(table.c.value), 0) + 1
+        )))
+    return connection.execute(db.select(table.c.value).where(table.c.id == owner_id)).scalar()
+
+
+def bump_product_change_versions(product_ids):
+    """Bump the counters of the vendors owning product_ids; returns the new version as a per-product SQL expression"""
+    table = SyncVersion.__table__
+    owners = db.select(Shop.owner_id).join(Product, Product.shop_id == Shop.id).where(Product.id.in_(product_ids))
+    db.session.execute(table.update().where(table.c.id.in_(owners)).values(value=table.c.value + 1))
+    return db.select(table.c.value).join(Shop, Shop.owner_id == table.c.id).where(
+        Shop.id == Product.shop_id
+    ).scalar_subquery()
+
+
+@event.listens_for(db.session, 'before_flush')
+def stamp_change_versions(session, flush_context, instances):
+    changed = [
+        obj for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, (Shop, Product)) and (obj in session.new or session.is_modified(obj))
+    ]
+    if not changed:
+        return
+    
+    connection = session.connection()
+    shop_ids = {obj.shop_id for obj in changed if isinstance(obj, Product) and obj.shop_id is not None}
+    shop_owners = dict(connection.execute(
+        db.select(Shop.id, Shop.owner_id).where(Shop.id.in_(shop_ids))
+    ).all()) if shop_ids else {}
+    
+    owned = []
+    for obj in changed:
+        if isinstance(obj, Shop):
+            owner_id = obj.owner_id
+        elif obj.shop_id is not None:
+            owner_id = shop_owners.get(obj.shop_id)
+        else:
+            owner_id = obj.shop.owner_id if obj.shop is not None else None
+        if owner_id is not None:
+            owned.append((owner_id, obj))
+    
+    # Sorted so concurrent flushes touching several vendors lock their counters in the same order
+    versions = {
+        owner_id: next_change_version(owner_id, connection) for owner_id in sorted({owner_id for owner_id, _ in owned})
+    }
+    for owner_id, obj in owned:
+        obj.change_version = versions[owner_id]
+
+
+def upsert_insert(table):
+    """INSERT statement supporting ON CONFLICT on SQLite/PostgreSQL; None on other dialects"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(table)
+
+
+def upsert_increments(model, key_columns, rows):
+    """Insert rollup rows, adding their values onto existing rows with the same key"""
+    if not rows:
+        return
+    
+    table = model.__table__
+    value_columns = [name for name in rows[0] if name not in key_columns]
+    stmt = upsert_insert(table)
+    
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[name] for name in key_columns],
+            set_={name: table.c[name] + stmt.excluded[name] for name in value_columns}
+        )
+        db.session.execute(stmt, rows)
+        return
+    
+    for row in rows:
+        updated = model.query.filter_by(**{name: row[name] for name in key_columns}).update({
+            getattr(model, name): getattr(model, name) + row[name] for name in value_columns
+        }, synchronize_session=False)
+        if not updated:
+            db.session.add(model(**row))
+
+
+def bump_metrics(deltas, month=None):
+    """Add deltas to platform-wide ledger counters, optionally also to a monthly bucket"""
+    # Each session writes one random shard, so concurrent sales rarely wait on the same row
+    # and a transaction never locks two shards of a metric in an order another could reverse
+    shard = db.session.info.setdefault('metric_shard', secrets.randbelow(app.config['METRIC_SHARDS']))
+    rows = [{'name': name, 'period': 'all', 'shard': shard, 'value': delta} for name, delta in deltas.items()]
+    if month is not None:
+        rows += [{'name': name, 'period': month.strftime('%Y-%m'), 'shard': shard, 'value': delta}
+                 for name, delta in deltas.items()]
+    upsert_increments(PlatformMetric, ('name', 'period', 'shard'), rows)
+
+
+def read_metrics(*keys):
+    """Read (name, period) ledger values, summed over their shards, in one query; missing entries read as 0"""
+    values = {key: 0 for key in keys}
+    rows = db.session.query(PlatformMetric.name, PlatformMetric.period, db.func.sum(PlatformMetric.value)).filter(
+        db.tuple_(PlatformMetric.name, PlatformMetric.period).in_(list(keys))
+    ).group_by(PlatformMetric.name, PlatformMetric.period)
+    for name, period, value in rows:
+        values[(name, period)] = value
+    return values
+
+
+# A sale whose mobile money payment failed or expired is void: its stock, rollup and ledger
+# amounts are reversed (see void_sale_bookings), so rebuilds and totals must skip it too
+VOID_SALE_STATUS = 'payment_failed'
+
+
+def record_daily_sale(shop_id, sold_at, amount, item_count, sale_count=1):
+    """Add sales to the per-shop daily rollup and revenue ledger inside the current transaction"""
+    upsert_increments(ShopDailySales, ('shop_id', 'day'), [{
+        'shop_id': shop_id,
+        'day': sold_at.date(),
+        'revenue': amount,
+        'sale_count': sale_count,
+        'item_count': item_count
+    }])
+    bump_metrics({'revenue': amount, 'sales': sale_count}, month=sold_at)
+
+
+def record_product_sales(lines):
+    """Add sold line items to per-product counters and daily buckets in the current transaction
+    
+    Each line is a dict with product_id, shop_id, sold_at, quantity and subtotal.
+    """
+    totals = {}
+    daily = {}
+    for line in lines:
+        product_id = int(line['product_id'])
+        units, revenue = totals.get(product_id, (0, 0))
+        totals[product_id] = (units + int(line['quantity']), revenue + float(line['subtotal']))
+        
+        key = (product_id, line['shop_id'], line['sold_at'].date())
+        units, revenue = daily.get(key, (0, 0))
+        daily[key] = (units + int(line['quantity']), revenue + float(line['subtotal']))
+    
+    if not totals:
+        return
+    
+    units_sold = db.case({product_id: units for product_id, (units, _) in totals.items()}, value=Product.id)
+    revenue = db.case({product_id: amount for product_id, (_, amount) in totals.items()}, value=Product.id)
+    db.session.execute(
+        Product.__table__.update()
+        .where(Product.id.in_(list(totals)))
+        .values(
+            units_sold=db.func.coalesce(Product.units_sold, 0) + units_sold,
+            revenue=db.func.coalesce(Product.revenue, 0) + revenue
+        )
+    )
+    
+    upsert_increments(ProductDailySales, ('product_id', 'day'), [{
+        'product_id': product_id,
+        'shop_id': shop_id,
+        'day': day,
+        'units_sold': units,
+        'revenue': amount
+    } for (product_id, shop_id, day), (units, amount) in daily.items()])
+
+
+def rebuild_product_sales():
+    """Recompute per-product sales counters and daily buckets from sale items"""
+    day = db.func.date(Sale.created_at)
+    buckets = db.session.query(
+        SaleItem.product_id, Sale.shop_id, day,
+        db.func.sum(SaleItem.quantity), db.func.sum(SaleItem.subtotal)
+    ).join(Sale, SaleItem.sale_id == Sale.id).filter(
+        Sale.status != VOID_SALE_STATUS
+    ).group_by(SaleItem.product_id, Sale.shop_id, day)
+    
+    rows = [{
+        'product_id': product_id,
+        'shop_id': shop_id,
+        'day': sale_day if not isinstance(sale_day, str) else datetime.strptime(sale_day, '%Y-%m-%d').date(),
+        'units_sold': int(units or 0),
+        'revenue': float(revenue or 0)
+    } for product_id, shop_id, sale_day, units, revenue in buckets]
+    
+    ProductDailySales.query.delete(synchronize_session=False)
+    if rows:
+        db.session.execute(ProductDailySales.__table__.insert(), rows)
+    
+    booked_items = db.select(SaleItem.product_id, SaleItem.quantity, SaleItem.subtotal).join(
+        Sale, SaleItem.sale_id == Sale.id
+    ).where(Sale.status != VOID_SALE_STATUS).subquery()
+    db.session.execute(Product.__table__.update().values(
+        units_sold=db.select(db.func.coalesce(db.func.sum(booked_items.c.quantity), 0))
+            .where(booked_items.c.product_id == Product.id).scalar_subquery(),
+        revenue=db.select(db.func.coalesce(db.func.sum(booked_items.c.subtotal), 0))
+            .where(booked_items.c.product_id == Product.id).scalar_subquery()
+    ))
+    db.session.commit()
+    
+    return len(rows)
+
+
+def rebuild_daily_sales(shop_ids=None):
+    """Recompute the daily sales rollup from the raw sales tables"""
+    day = db.func.date(Sale.created_at)
+    
+    sales_query = db.session.query(
+        Sale.shop_id, day, db.func.sum(Sale.total_amount), db.func.count(Sale.id)
+    ).filter(Sale.status != VOID_SALE_STATUS)
+    items_query = db.session.query(
+        Sale.shop_id, day, db.func.sum(SaleItem.quantity)
+    ).join(SaleItem, SaleItem.sale_id == Sale.id).filter(Sale.status != VOID_SALE_STATUS)
+    delete_query = ShopDailySales.query
+    
+    if shop_ids is not None:
+        sales_query = sales_query.filter(Sale.shop_id.in_(shop_ids))
+        items_query = items_query.filter(Sale.shop_id.in_(shop_ids))
+        delete_query = delete_query.filter(ShopDailySales.shop_id.in_(shop_ids))
+    
+    item_counts = {
+        (shop_id, str(sale_day)): int(quantity or 0)
+        for shop_id, sale_day, quantity in items_query.group_by(Sale.shop_id, day)
+    }
+    
+    rows = []
+    for shop_id, sale_day, revenue, sale_count in sales_query.group_by(Sale.shop_id, day):
+        rows.append({
+            'shop_id': shop_id,
+            'day': sale_day if not isinstance(sale_day, str) else datetime.strptime(sale_day, '%Y-%m-%d').date(),
+            'revenue': float(revenue or 0),
+            'sale_count': sale_count,
+            'item_count': item_counts.get((shop_id, str(sale_day)), 0)
+        })
+    
+    delete_query.delete(synchronize_session=False)
+    if rows:
+        db.session.execute(ShopDailySales.__table__.insert(), rows)
     db.session.commit()
-    print("✅ Default admin user created (phone: admin, password: admin123)")
+    
+    return len(rows)
+
+def lock_metrics_ledger():
+    """Hold off bump_metrics() writers until the current transaction ends"""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('LOCK TABLE platform_metrics IN SHARE ROW EXCLUSIVE MODE'))
+    else:
+        # A no-op write takes SQLite's database write lock for the rest of the transaction
+        db.session.execute(PlatformMetric.__table__.update().where(db.false()).values(value=PlatformMetric.value))
 
-# Initialize database immediately when the app starts
-with app.app_context():
-    init_db()
 
+def ensure_metric_shards(connection):
+    """Rebuild a pre-shard platform_metrics table keyed on (name, period); returns True if rebuilt"""
+    table = PlatformMetric.__table__
+    constraints = db.inspect(connection).get_unique_constraints(table.name)
+    if {'name', 'period'} not in [set(constraint['column_names']) for constraint in constraints]:
+        return False
+    
+    # The ledger is a few dozen rows, so copying it beats per-dialect constraint surgery
+    rows = [{'name': name, 'period': period, 'shard': 0, 'value': value} for name, period, value in connection.execute(
+        db.text(f'SELECT name, period, value FROM {table.name}')
+    )]
+    connection.execute(db.text(f'DROP TABLE {table.name}'))
+    table.create(connection)
+    if rows:
+        connection.execute(table.insert(), rows)
+    return True
+
+
+def reconcile_metrics(repair=True):
+    """Compare the platform ledger with the source tables and optionally repair drift"""
+    if repair:
+        # Writers block briefly; otherwise a bump committed mid-recount would be double counted or lost
+        lock_metrics_ledger()
+    
+    expected = {
+        ('users', 'all'): User.query.count(),
+        ('shops', 'all'): Shop.query.count(),
+        ('products', 'all'): Product.query.count(),
+        ('revenue', 'all'): db.session.query(db.func.coalesce(db.func.sum(Sale.total_amount), 0)).filter(
+            Sale.status != VOID_SALE_STATUS
+        ).scalar(),
+        ('sales', 'all'): Sale.query.filter(Sale.status != VOID_SALE_STATUS).count(),
+        ('expenses', 'all'): db.session.query(db.func.coalesce(db.func.sum(Expense.amount), 0)).scalar()
+    }
+    month = sql_date_bucket(Sale.created_at, 'month')
+    for bucket, revenue, count in db.session.query(
+        month, db.func.sum(Sale.total_amount), db.func.count(Sale.id)
+    ).filter(Sale.status != VOID_SALE_STATUS).group_by(month):
+        expected[('revenue', bucket[:7])] = revenue
+        expected[('sales', bucket[:7])] = count
+    
+    actual = {
+        (name, period): value
+        for name, period, value in db.session.query(
+            PlatformMetric.name, PlatformMetric.period, db.func.sum(PlatformMetric.value)
+        ).filter(
+            PlatformMetric.name.in_(['users', 'shops', 'products', 'revenue', 'sales', 'expenses'])
+        ).group_by(PlatformMetric.name, PlatformMetric.period)
+    }
+    
+    drift = []
+    for key in set(expected) | set(actual):
+        expected_value = float(expected.get(key) or 0)
+        actual_value = actual.get(key, 0)
+        if abs(expected_value - actual_value) > 1e-6:
+            drift.append({'name': key[0], 'period': key[1], 'expected': expected_value, 'actual': actual_value})
+    
+    if repair:
+        # Apply the drift as an increment to shard 0, like every other ledger write
+        if drift:
+            upsert_increments(PlatformMetric, ('name', 'period', 'shard'), [
+                {'name': entry['name'], 'period': entry['period'], 'shard': 0,
+                 'value': entry['expected'] - entry['actual']}
+                for entry in drift
+            ])
+        db.session.commit()
+    return drift
 
 
 # PART 3: AUTHENTICATION & AUTHORIZATION
 
 
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after a TTL"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisUserCache(TTLCache):
+    """User cache shared by all worker processes through Redis"""
+    
+    def __init__(self, url, ttl):
+        import redis
+        super().__init__(0, ttl)
+        self.redis = redis.Redis.from_url(url)
+    
+    def get(self, user_id):
+        data = self.redis.get(f'user:{user_id}')
+        if data is None:
+            return None
+        values = json.loads(data)
+        for column in User.__table__.columns:
+            if isinstance(column.type, db.DateTime) and values.get(column.name):
+                values[column.name] = datetime.fromisoformat(values[column.name])
+        return values
+    
+    def set(self, user_id, values):
+        self.redis.setex(f'user:{user_id}', self.ttl, json.dumps(values, default=lambda v: v.isoformat()))
+    
+    def invalidate(self, user_id):
+        self.redis.delete(f'user:{user_id}')
+
+
+if app.config['USER_CACHE_REDIS_URL']:
+    user_cache = RedisUserCache(app.config['USER_CACHE_REDIS_URL'], app.config['USER_CACHE_TTL'])
+else:
+    user_cache = TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+shop_scope_cache = TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+# The password hash never leaves the database; it is lazily loaded if a cached user needs it
+USER_CACHE_COLUMNS = tuple(column.name for column in User.__table__.columns if column.name != 'password_hash')
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    user = db.session.identity_map.get(identity_key(User, user_id))
+    
+    if user is None:
+        values = user_cache.get(user_id)
+        if values is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            user_cache.set(user_id, {name: getattr(user, name) for name in USER_CACHE_COLUMNS})
+        else:
+            # Attach a copy built from the cached row without querying the database
+            user = User(**values)
+            make_transient_to_detached(user)
+            db.session.add(user)
+    
+    # Deactivated users lose access at the latest when their cache entry expires
+    return user if user.is_active else None
+
+
+def user_shop_ids(user_id, refresh=False):
+    """IDs of user_id's shops, cached across requests"""
+    shop_ids = None if refresh else shop_scope_cache.get(user_id)
+    if shop_ids is None:
+        shop_ids = frozenset(shop_id for (shop_id,) in db.session.query(Shop.id).filter(
+            Shop.owner_id == user_id
+        ))
+        shop_scope_cache.set(user_id, shop_ids)
+    return shop_ids
+
+
+def owned_shop_ids(refresh=False):
+    """IDs of the current user's shops, resolved once per request and cached across requests"""
+    if not refresh and 'owned_shop_ids' in g:
+        return g.owned_shop_ids
+    
+    g.owned_shop_ids = user_shop_ids(current_user.id, refresh)
+    return g.owned_shop_ids
+
+
+def vendor_shops_query(user_id):
+    return Shop.query.filter_by(owner_id=user_id)
+
+
+def owned_shops_subquery(user=None):
+    """Subquery of the user's (default: current user's) shop IDs, for filtering inside a single SQL query"""
+    return db.select(Shop.id).where(Shop.owner_id == (user or current_user).id).scalar_subquery()
+
+
+def owns_shop(shop_id):
+    if current_user.role == 'admin':
+        return True
+    if int(shop_id) in owned_shop_ids():
+        return True
+    # Shops are only ever added, so a miss may just mean the cached set predates a new shop
+    return int(shop_id) in owned_shop_ids(refresh=True)
+
+
+def user_owns_shop(user, shop_id):
+    """owns_shop() for an explicit user, for code running outside a request such as jobs"""
+    if user.role == 'admin':
+        return True
+    return int(shop_id) in user_shop_ids(user.id) or int(shop_id) in user_shop_ids(user.id, refresh=True)
 
 
-def role_required(roles):
+def invalidate_shop_scope(user_id):
+    shop_scope_cache.invalidate(user_id)
+    g.pop('owned_shop_ids', None)
+
+
+def role_required(roles, shop_arg=None):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -236,12 +1006,82 @@ def role_required(roles):
             if current_user.role not in roles:
                 flash('Hakuna ruhusa ya kufikia ukurasa huu', 'danger')
                 return redirect(url_for('dashboard'))
+            if shop_arg and not owns_shop(kwargs[shop_arg]):
+                flash('Hakuna ruhusa', 'danger')
+                return redirect(url_for('shops'))
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
 
 
+# PART 3B: PAGINATION HELPERS
+
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+
+
+def encode_cursor(sort_value, row_id):
+    token = f'{sort_value.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, date_only=False):
+    """Decode a keyset cursor; raises ValueError if it is malformed"""
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        sort_value, row_id = token.rsplit('|', 1)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    sort_value = datetime.fromisoformat(sort_value)
+    return (sort_value.date() if date_only else sort_value), int(row_id)
+
+
+def keyset_query(query, sort_column, id_column, cursor=None, page_size=PAGE_SIZE_DEFAULT):
+    """Order query newest first after cursor, fetching one extra row to detect a next page"""
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor, date_only=isinstance(sort_column.type, db.Date))
+        query = query.filter(db.tuple_(sort_column, id_column) < (sort_value, row_id))
+    return query.order_by(sort_column.desc(), id_column.desc()).limit(page_size + 1)
+
+
+def keyset_page(query, sort_column, id_column):
+    """Return one page of rows ordered newest first plus the cursor for the next page"""
+    page_size = min(max(request.args.get('limit', PAGE_SIZE_DEFAULT, type=int), 1), PAGE_SIZE_MAX)
+    rows = keyset_query(query, sort_column, id_column, request.args.get('cursor'), page_size).all()
+    
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    
+    return rows, next_cursor
+
+
+def wants_json():
+    return request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+
+def model_to_dict(obj, exclude=()):
+    data = {}
+    for column in obj.__table__.columns:
+        if column.name in exclude:
+            continue
+        value = getattr(obj, column.name)
+        data[column.name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return data
+
+
+def page_json(rows, next_cursor, exclude=()):
+    return jsonify({
+        'items': [model_to_dict(row, exclude) for row in rows],
+        'next_cursor': next_cursor
+    })
+
+
+
 # PART 4: ROUTES - AUTHENTICATION
 
 
@@ -272,6 +1112,7 @@ def register():
         user.set_password(data['password'])
         
         db.session.add(user)
+        bump_metrics({'users': 1})
         db.session.commit()
         
         flash('Umefanikiwa kujiandikisha! Tafadhali ingia', 'success')
@@ -313,62 +1154,74 @@ def logout():
 # PART 5: ROUTES - DASHBOARD & ANALYTICS
 
 
+def recent_sales_query(shop_ids, limit):
+    return Sale.query.filter(Sale.shop_id.in_(shop_ids)).order_by(Sale.created_at.desc()).limit(limit)
+
+
+def vendor_dashboard_stats(shop_ids, recent_limit=10):
+    """Aggregate dashboard stats for a set of shops in a fixed number of queries"""
+    stats = {
+        'total_sales': 0,
+        'today_sales': 0,
+        'total_products': 0,
+        'low_stock_count': 0,
+        'recent_sales': []
+    }
+    if not shop_ids:
+        return stats
+    
+    today = datetime.utcnow().date()
+    
+    total_sales, today_sales = db.session.query(
+        db.func.coalesce(db.func.sum(ShopDailySales.revenue), 0),
+        db.func.coalesce(db.func.sum(db.case(
+            (ShopDailySales.day == today, ShopDailySales.revenue),
+            else_=0
+        )), 0)
+    ).filter(ShopDailySales.shop_id.in_(shop_ids)).one()
+    
+    total_products, low_stock_count = db.session.query(
+        db.func.count(Product.id),
+        db.func.coalesce(db.func.sum(db.case(
+            (Product.quantity <= Product.reorder_level, 1),
+            else_=0
+        )), 0)
+    ).filter(Product.shop_id.in_(shop_ids), Product.is_active == True).one()
+    
+    stats['total_sales'] = float(total_sales)
+    stats['today_sales'] = float(today_sales)
+    stats['total_products'] = int(total_products)
+    stats['low_stock_count'] = int(low_stock_count)
+    stats['recent_sales'] = recent_sales_query(shop_ids, recent_limit).all()
+    
+    return stats
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     if current_user.role == 'vendor':
-        shops = Shop.query.filter_by(owner_id=current_user.id).all()
-        
-        # Calculate stats
-        total_sales = 0
-        total_products = 0
-        low_stock_count = 0
-        today_sales = 0
-        
-        today = datetime.utcnow().date()
-        
-        for shop in shops:
-            shop_sales = Sale.query.filter_by(shop_id=shop.id).all()
-            total_sales += sum(sale.total_amount for sale in shop_sales)
-            
-            today_shop_sales = Sale.query.filter_by(shop_id=shop.id).filter(
-                db.func.date(Sale.created_at) == today
-            ).all()
-            today_sales += sum(sale.total_amount for sale in today_shop_sales)
-            
-            products = Product.query.filter_by(shop_id=shop.id, is_active=True).all()
-            total_products += len(products)
-            low_stock_count += len([p for p in products if p.quantity <= p.reorder_level])
-        
-        # Recent sales
-        recent_sales = []
-        for shop in shops:
-            shop_recent = Sale.query.filter_by(shop_id=shop.id).order_by(
-                Sale.created_at.desc()
-            ).limit(5).all()
-            recent_sales.extend(shop_recent)
-        
-        recent_sales = sorted(recent_sales, key=lambda x: x.created_at, reverse=True)[:10]
+        shops = vendor_shops_query(current_user.id).all()
+        stats = vendor_dashboard_stats([shop.id for shop in shops])
         
         # Alerts
-        alerts = Alert.query.filter_by(user_id=current_user.id, is_read=False).order_by(
-            Alert.created_at.desc()
-        ).limit(5).all()
+        alerts = recent_alerts_query(current_user.id).all()
         
         return render_template('dashboard_vendor.html',
                              shops=shops,
-                             total_sales=total_sales,
-                             today_sales=today_sales,
-                             total_products=total_products,
-                             low_stock_count=low_stock_count,
-                             recent_sales=recent_sales,
+                             total_sales=stats['total_sales'],
+                             today_sales=stats['today_sales'],
+                             total_products=stats['total_products'],
+                             low_stock_count=stats['low_stock_count'],
+                             recent_sales=stats['recent_sales'],
                              alerts=alerts)
     
     elif current_user.role == 'admin':
-        total_users = User.query.count()
-        total_shops = Shop.query.count()
-        total_products = Product.query.count()
-        total_sales = db.session.query(db.func.sum(Sale.total_amount)).scalar() or 0
+        metrics = read_metrics(('users', 'all'), ('shops', 'all'), ('products', 'all'), ('revenue', 'all'))
+        total_users = int(metrics[('users', 'all')])
+        total_shops = int(metrics[('shops', 'all')])
+        total_products = int(metrics[('products', 'all')])
+        total_sales = metrics[('revenue', 'all')]
         
         return render_template('dashboard_admin.html',
                              total_users=total_users,
@@ -390,7 +1243,7 @@ def shops():
     if current_user.role == 'admin':
         all_shops = Shop.query.all()
     else:
-        all_shops = Shop.query.filter_by(owner_id=current_user.id).all()
+        all_shops = vendor_shops_query(current_user.id).all()
     
     return render_template('shops.html', shops=all_shops)
 
@@ -409,7 +1262,9 @@ def create_shop():
         )
         
         db.session.add(shop)
+        bump_metrics({'shops': 1})
         db.session.commit()
+        invalidate_shop_scope(current_user.id)
         
         flash('Duka limeundwa kikamilifu!', 'success')
         return redirect(url_for('shops'))
@@ -417,17 +1272,18 @@ def create_shop():
     return render_template('shop_create.html')
 
 
+def shop_products_query(shop_id):
+    return Product.query.filter_by(shop_id=shop_id, is_active=True)
+
+
 @app.route('/shop/<int:shop_id>')
 @login_required
+@role_required(['vendor', 'admin'], shop_arg='shop_id')
 def shop_detail(shop_id):
     shop = Shop.query.get_or_404(shop_id)
     
-    if current_user.role != 'admin' and shop.owner_id != current_user.id:
-        flash('Hakuna ruhusa', 'danger')
-        return redirect(url_for('shops'))
-    
-    products = Product.query.filter_by(shop_id=shop_id, is_active=True).all()
-    sales = Sale.query.filter_by(shop_id=shop_id).order_by(Sale.created_at.desc()).limit(20).all()
+    products = shop_products_query(shop_id).all()
+    sales = recent_sales_query([shop_id], 20).all()
     
     return render_template('shop_detail.html', shop=shop, products=products, sales=sales)
 
@@ -436,17 +1292,25 @@ def shop_detail(shop_id):
 # PART 7: ROUTES - INVENTORY MANAGEMENT
 
 
+def product_list_query(user):
+    """Products the user may list: their own shops' for a vendor, all of them for an admin"""
+    if user.role == 'vendor':
+        return Product.query.filter(Product.shop_id.in_(owned_shops_subquery(user)))
+    return Product.query
+
+
 @app.route('/products')
 @login_required
 def products():
-    if current_user.role == 'vendor':
-        user_shops = Shop.query.filter_by(owner_id=current_user.id).all()
-        shop_ids = [shop.id for shop in user_shops]
-        all_products = Product.query.filter(Product.shop_id.in_(shop_ids)).all()
-    else:
-        all_products = Product.query.all()
+    try:
+        page, next_cursor = keyset_page(product_list_query(current_user), Product.created_at, Product.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return render_template('products.html', products=all_products)
+    if wants_json():
+        return page_json(page, next_cursor)
+    
+    return render_template('products.html', products=page, next_cursor=next_cursor)
 
 
 @app.route('/product/add', methods=['GET', 'POST'])
@@ -457,7 +1321,7 @@ def add_product():
         # Generate SKU if not provided
         sku = request.form.get('sku')
         if not sku:
-            sku = f"PRD{datetime.utcnow().timestamp():.0f}"
+            sku = generate_number('PRD')
         
         expiry = request.form.get('expiry_date')
         expiry_date = datetime.strptime(expiry, '%Y-%m-%d').date() if expiry else None
@@ -477,23 +1341,20 @@ def add_product():
         )
         
         db.session.add(product)
-        db.session.commit()
+        db.session.flush()
+        bump_metrics({'products': 1})
         
         # Check if low stock alert needed
-        if product.quantity <= product.reorder_level:
-            alert = Alert(
-                user_id=current_user.id,
-                title='Bidhaa zimepungua',
-                message=f'{product.name} iko chini ya kiwango cha uhakika',
-                alert_type='low_stock'
-            )
-            db.session.add(alert)
-            db.session.commit()
+        alerts = create_low_stock_alerts(current_user.id, [product.id])
+        db.session.commit()
+        
+        emit_stock_levels([product.id])
+        emit_alerts(alerts)
         
         flash('Bidhaa imeongezwa kikamilifu!', 'success')
         return redirect(url_for('products'))
     
-    shops = Shop.query.filter_by(owner_id=current_user.id).all()
+    shops = vendor_shops_query(current_user.id).all()
     return render_template('product_add.html', shops=shops)
 
 
@@ -509,7 +1370,13 @@ def update_product(product_id):
         product.description = request.form.get('description')
         product.updated_at = datetime.utcnow()
         
+        db.session.flush()
+        alerts = create_low_stock_alerts(product.shop.owner_id, [product.id])
         db.session.commit()
+        
+        emit_stock_levels([product.id])
+        emit_alerts(alerts)
+        
         flash('Bidhaa imesasishwa!', 'success')
         return redirect(url_for('products'))
     
@@ -517,100 +1384,884 @@ def update_product(product_id):
 
 
 
-# PART 8: ROUTES - SALES MANAGEMENT
+# PART 7B: PRODUCT & SHOP IMAGES
 
 
-@app.route('/sales')
-@login_required
-def sales():
-    if current_user.role == 'vendor':
-        user_shops = Shop.query.filter_by(owner_id=current_user.id).all()
-        shop_ids = [shop.id for shop in user_shops]
-        all_sales = Sale.query.filter(Sale.shop_id.in_(shop_ids)).order_by(
-            Sale.created_at.desc()
-        ).all()
-    else:
-        all_sales = Sale.query.order_by(Sale.created_at.desc()).all()
-    
-    return render_template('sales.html', sales=all_sales)
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_MAX_AGE = 365 * 24 * 3600  # content-addressed files never change
+THUMBNAIL_SIZES = (160, 480)
 
 
-@app.route('/sale/create', methods=['GET', 'POST'])
-@login_required
-@role_required(['vendor'])
-def create_sale():
-    if request.method == 'POST':
-        data = request.json
-        
-        # Generate sale number
-        sale_number = f"SALE{datetime.utcnow().timestamp():.0f}"
-        
-        sale = Sale(
-            sale_number=sale_number,
-            shop_id=data['shop_id'],
-            customer_name=data.get('customer_name'),
-            customer_phone=data.get('customer_phone'),
-            total_amount=float(data['total_amount']),
-            payment_method=data.get('payment_method', 'cash'),
-            payment_reference=data.get('payment_reference'),
-            notes=data.get('notes')
-        )
+def image_root():
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], 'images')
+
+
+def image_path(content_hash, suffix):
+    """Content-addressed location, sharded by the first two hex digits"""
+    return os.path.join(image_root(), content_hash[:2], f'{content_hash}{suffix}')
+
+
+def sniff_image_type(head):
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def store_image(stream, user_id):
+    """Stream an upload to disk in chunks while hashing it; identical content is stored once"""
+    os.makedirs(image_root(), exist_ok=True)
+    digest = hashlib.sha256()
+    head = b''
+    size = 0
+    
+    fd, temp_path = tempfile.mkstemp(dir=image_root(), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            while True:
+                chunk = stream.read(IMAGE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < 12:
+                    head += chunk[:12 - len(head)]
+                digest.update(chunk)
+                temp_file.write(chunk)
+                size += len(chunk)
         
-        db.session.add(sale)
-        db.session.flush()
+        extension = sniff_image_type(head)
+        if extension is None:
+            raise ValueError('Only JPEG, PNG and WebP images are supported')
         
-        # Add sale items and update inventory
-        for item in data['items']:
-            product = Product.query.get(item['product_id'])
-            
-            if product.quantity < item['quantity']:
-                db.session.rollback()
-                return jsonify({'error': f'Stock ya {product.name} hazitosha'}), 400
-            
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                product_id=item['product_id'],
-                quantity=item['quantity'],
-                unit_price=item['unit_price'],
-                subtotal=item['subtotal']
-            )
-            
-            # Update product quantity
-            product.quantity -= item['quantity']
-            
-            db.session.add(sale_item)
+        content_hash = digest.hexdigest()
+        asset = ImageAsset.query.filter_by(content_hash=content_hash).first()
+        if asset is not None:
+            return asset, False
         
-        db.session.commit()
+        path = image_path(content_hash, f'.{extension}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        asset = ImageAsset(content_hash=content_hash, extension=extension, size=size, uploaded_by=user_id)
+        db.session.add(asset)
+        return asset, True
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def generate_thumbnails(content_hash, extension):
+    """Write a JPEG thumbnail per THUMBNAIL_SIZES and return the original dimensions"""
+    from PIL import Image, ImageOps
+    
+    with Image.open(image_path(content_hash, f'.{extension}')) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
         
-        return jsonify({'success': True, 'sale_id': sale.id, 'sale_number': sale_number})
+        for size in THUMBNAIL_SIZES:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            path = image_path(content_hash, f'_{size}.jpg')
+            thumbnail.save(path + '.part', 'JPEG', quality=80, optimize=True, progressive=True)
+            os.replace(path + '.part', path)
     
-    shops = Shop.query.filter_by(owner_id=current_user.id).all()
-    return render_template('sale_create.html', shops=shops)
+    return width, height
 
 
-@app.route('/api/shop/<int:shop_id>/products')
-@login_required
-def get_shop_products(shop_id):
-    products = Product.query.filter_by(shop_id=shop_id, is_active=True).all()
-    return jsonify([{
-        'id': p.id,
-        'name': p.name,
-        'price': p.price,
-        'quantity': p.quantity,
-        'unit': p.unit
-    } for p in products])
+def mark_image_failed(error, asset_id):
+    print(f"❌ Thumbnail generation failed for image {asset_id}: {error}")
+    ImageAsset.query.filter_by(id=asset_id).update({'status': 'failed'}, synchronize_session=False)
+    db.session.commit()
+
+
+@job_task('process_image', on_failure=mark_image_failed)
+def process_image(asset_id):
+    """Generate an uploaded image's thumbnails and record its dimensions"""
+    asset = db.session.get(ImageAsset, asset_id)
+    if asset is None:
+        return None
+    asset.width, asset.height = generate_thumbnails(asset.content_hash, asset.extension)
+    asset.status = 'ready'
+    db.session.commit()
+    return {'width': asset.width, 'height': asset.height}
+
+
+@app.template_global()
+def thumbnail_url(content_hash, size=THUMBNAIL_SIZES[0]):
+    return url_for('serve_image', name=f'{content_hash}_{size}.jpg')
+
+
+def image_json(asset):
+    return {
+        'hash': asset.content_hash,
+        'status': asset.status,
+        'url': url_for('serve_image', name=f'{asset.content_hash}.{asset.extension}'),
+        'thumbnails': {size: thumbnail_url(asset.content_hash, size) for size in THUMBNAIL_SIZES}
+    }
+
+
+def attach_image(target):
+    """Store the uploaded 'image' file and point target (a Product or Shop) at it"""
+    upload = request.files.get('image')
+    if not upload:
+        return jsonify({'error': 'image file is required'}), 400
+    
+    try:
+        asset, created = store_image(upload.stream, current_user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    target.image_hash = asset.content_hash
+    try:
+        if created:
+            db.session.flush()
+            enqueue_job('process_image', {'asset_id': asset.id}, user_id=current_user.id)
+        db.session.commit()
+    except IntegrityError:
+        # Someone uploaded the same image concurrently; use their row
+        db.session.rollback()
+        asset = ImageAsset.query.filter_by(content_hash=asset.content_hash).one()
+        target.image_hash = asset.content_hash
+        db.session.commit()
+    
+    return jsonify({'success': True, 'image': image_json(asset)})
+
+
+@app.route('/product/<int:product_id>/image', methods=['POST'])
+@login_required
+def upload_product_image(product_id):
+    product = Product.query.get_or_404(product_id)
+    if not owns_shop(product.shop_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    return attach_image(product)
+
+
+@app.route('/shop/<int:shop_id>/image', methods=['POST'])
+@login_required
+def upload_shop_image(shop_id):
+    shop = Shop.query.get_or_404(shop_id)
+    if not owns_shop(shop_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    return attach_image(shop)
+
+
+@app.route('/images/<name>')
+def serve_image(name):
+    """Serve originals and thumbnails with immutable caching and Range support"""
+    match = re.fullmatch(r'([0-9a-f]{64})(?:_(\d+))?\.(jpg|png|webp)', name)
+    if not match:
+        return jsonify({'error': 'Image not found'}), 404
+    content_hash, size, extension = match.groups()
+    if size and (int(size) not in THUMBNAIL_SIZES or extension != 'jpg'):
+        return jsonify({'error': 'Image not found'}), 404
+    
+    path = image_path(content_hash, f'_{size}.jpg' if size else f'.{extension}')
+    if not os.path.exists(path):
+        asset = ImageAsset.query.filter_by(content_hash=content_hash).first() if size else None
+        if asset is not None:
+            # Thumbnail still being generated; the redirect itself is not cached
+            return redirect(url_for('serve_image', name=f'{content_hash}.{asset.extension}'))
+        return jsonify({'error': 'Image not found'}), 404
+    
+    response = send_file(path, conditional=True, max_age=IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.cli.command('generate-thumbnails')
+def generate_thumbnails_command():
+    """Generate thumbnails synchronously for images left pending or failed"""
+    with app.app_context():
+        asset_ids = [asset_id for (asset_id,) in db.session.query(ImageAsset.id).filter(ImageAsset.status != 'ready')]
+        for asset_id in asset_ids:
+            try:
+                process_image(asset_id)
+            except Exception as e:
+                db.session.rollback()
+                mark_image_failed(e, asset_id)
+    print(f"✅ Processed {len(asset_ids)} images")
+
+
+
+# PART 7C: BULK PRODUCT IMPORT
+
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+IMPORT_COLUMNS = ('name', 'description', 'price', 'cost_price', 'quantity', 'unit',
+                  'barcode', 'category', 'expiry_date', 'reorder_level')
+
+
+def parse_import_row(raw):
+    """Validate one catalog row and return it with the same defaults as add_product"""
+    def text(key, limit=None):
+        value = raw.get(key)
+        value = str(value).strip() if value is not None else ''
+        if limit and len(value) > limit:
+            raise ValueError(f'{key} longer than {limit} characters')
+        return value or None
+    
+    def number(key, cast, default=None):
+        value = raw.get(key)
+        if value is None or str(value).strip() == '':
+            if default is None:
+                raise ValueError(f'{key} is required')
+            return default
+        try:
+            value = cast(str(value).strip())
+        except ValueError:
+            raise ValueError(f'{key} must be a number')
+        if value < 0:
+            raise ValueError(f'{key} must not be negative')
+        return value
+    
+    sku = text('sku', 50)
+    name = text('name', 200)
+    if not sku:
+        raise ValueError('sku is required')
+    if not name:
+        raise ValueError('name is required')
+    
+    expiry = text('expiry_date')
+    try:
+        expiry_date = datetime.strptime(expiry, '%Y-%m-%d').date() if expiry else None
+    except ValueError:
+        raise ValueError('expiry_date must be YYYY-MM-DD')
+    
+    return {
+        'sku': sku,
+        'name': name,
+        'description': text('description'),
+        'price': number('price', float),
+        'cost_price': number('cost_price', float, 0),
+        'quantity': number('quantity', int, 0),
+        'unit': text('unit', 20) or 'pcs',
+        'barcode': text('barcode', 100),
+        'category': text('category', 100),
+        'expiry_date': expiry_date,
+        'reorder_level': number('reorder_level', int, 10)
+    }
+
+
+def iter_import_rows(stream, fmt):
+    """Yield raw row dicts from a binary CSV, JSON Lines or JSON array stream"""
+    if fmt == 'json':
+        # A JSON array has to be parsed whole; use jsonl for very large catalogs
+        rows = json.load(stream)
+        if not isinstance(rows, list):
+            raise ValueError('JSON import must be an array of products')
+        yield from rows
+        return
+    
+    text_stream = TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'jsonl':
+        for line in text_stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(text_stream)
+
+
+def upsert_products(shop_id, rows, columns=IMPORT_COLUMNS):
+    """Insert or update catalog rows on (shop_id, sku) in one statement
+    
+    New products get every column; existing ones only have `columns` overwritten, so a file
+    without e.g. a quantity column leaves stock alone instead of resetting it to the default.
+    """
+    now = datetime.utcnow()
+    version = next_change_version(db.session.get(Shop, shop_id).owner_id)
+    for row in rows:
+        row.update(shop_id=shop_id, is_active=True, updated_at=now, change_version=version)
+    
+    table = Product.__table__
+    update_columns = tuple(columns) + ('is_active', 'updated_at', 'change_version')
+    stmt = upsert_insert(table)
+    
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.shop_id, table.c.sku],
+            set_={name: stmt.excluded[name] for name in update_columns}
+        )
+        db.session.execute(stmt, rows)
+        return
+    
+    for row in rows:
+        updated = Product.query.filter_by(shop_id=shop_id, sku=row['sku']).update(
+            {name: row[name] for name in update_columns}, synchronize_session=False
+        )
+        if not updated:
+            db.session.execute(table.insert(), [row])
+
+
+def import_products_batch(shop_id, owner_id, batch, report):
+    """Validate, upsert and alert on one batch of (row_number, raw) pairs, then commit"""
+    valid = {}
+    for row_number, raw in batch:
+        try:
+            row = parse_import_row(raw)
+        except ValueError as e:
+            report['errors'].append({'row': row_number, 'error': str(e)})
+            continue
+        except AttributeError:
+            report['errors'].append({'row': row_number, 'error': 'row must be an object'})
+            continue
+        if row['sku'] in report['seen_skus']:
+            report['errors'].append({'row': row_number, 'error': f"duplicate sku {row['sku']}"})
+            continue
+        report['seen_skus'].add(row['sku'])
+        provided = tuple(name for name in IMPORT_COLUMNS if name in raw)
+        valid[row['sku']] = (row_number, row, provided)
+    
+    if not valid:
+        return [], []
+    
+    # SKUs are globally unique, so one owned by another shop cannot be imported here
+    skus = list(valid)
+    existing = dict(db.session.query(Product.sku, Product.shop_id).filter(Product.sku.in_(skus)))
+    for sku, other_shop_id in existing.items():
+        if other_shop_id != shop_id:
+            row_number, _, _ = valid.pop(sku)
+            report['errors'].append({'row': row_number, 'error': f'sku {sku} belongs to another shop'})
+    
+    if not valid:
+        return [], []
+    
+    created = sum(1 for sku in valid if sku not in existing)
+    # One upsert per column set: a CSV has one, JSON objects may each carry different keys
+    groups = {}
+    for _, row, provided in valid.values():
+        groups.setdefault(provided, []).append(row)
+    for provided, rows in groups.items():
+        upsert_products(shop_id, rows, provided)
+    if created:
+        bump_metrics({'products': created})
+    
+    product_ids = [product_id for (product_id,) in db.session.query(Product.id).filter(
+        Product.shop_id == shop_id, Product.sku.in_(list(valid))
+    )]
+    alerts = create_low_stock_alerts(owner_id, product_ids)
+    db.session.commit()
+    
+    report['created'] += created
+    report['updated'] += len(valid) - created
+    return product_ids, alerts
+
+
+def import_products(shop_id, owner_id, raw_rows):
+    """Stream catalog rows into a shop in committed batches and report per-row errors"""
+    report = {'created': 0, 'updated': 0, 'errors': [], 'seen_skus': set()}
+    batch = []
+    
+    def flush():
+        product_ids, alerts = import_products_batch(shop_id, owner_id, batch, report)
+        emit_stock_levels(product_ids)
+        emit_alerts(alerts)
+        batch.clear()
+    
+    try:
+        for row_number, raw in enumerate(raw_rows, start=1):
+            batch.append((row_number, raw))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        # Batches before the bad spot stay committed; the counts say how far the import got
+        report['file_error'] = str(e)
+    if batch:
+        flush()
+    
+    invalidate_analytics([shop_id])
+    db.session.commit()
+    del report['seen_skus']
+    report['error_count'] = len(report['errors'])
+    report['errors'] = report['errors'][:IMPORT_MAX_ERRORS]
+    return report
+
+
+@app.route('/api/shop/<int:shop_id>/products/import', methods=['POST'])
+@login_required
+@role_required(['vendor'], shop_arg='shop_id')
+def import_shop_products(shop_id):
+    """Bulk create/update products from an uploaded CSV, JSON or JSON Lines catalog"""
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        filename = (upload.filename or '').lower()
+        default_format = 'jsonl' if filename.endswith('.jsonl') else 'json' if filename.endswith('.json') else 'csv'
+    else:
+        stream = request.stream
+        content_type = request.mimetype
+        default_format = 'jsonl' if content_type == 'application/x-ndjson' else 'json' if content_type == 'application/json' else 'csv'
+    
+    fmt = request.args.get('format', default_format)
+    if fmt not in ('csv', 'json', 'jsonl'):
+        return jsonify({'error': 'format must be csv, json or jsonl'}), 400
+    
+    report = import_products(shop_id, current_user.id, iter_import_rows(stream, fmt))
+    if 'file_error' in report:
+        return jsonify({'success': False, 'error': f"Unreadable file: {report.pop('file_error')}", **report}), 400
+    return jsonify({'success': True, **report})
+
+
+@app.cli.command('import-products')
+@click.argument('shop_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json', 'jsonl']), help='Defaults to the file extension')
+def import_products_command(shop_id, path, fmt):
+    """Bulk create/update a shop's products from a CSV, JSON or JSON Lines catalog"""
+    fmt = fmt or ('jsonl' if path.endswith('.jsonl') else 'json' if path.endswith('.json') else 'csv')
+    started = time.perf_counter()
+    with app.app_context():
+        shop = db.session.get(Shop, shop_id)
+        if shop is None:
+            raise click.ClickException(f'Shop {shop_id} not found')
+        with open(path, 'rb') as stream:
+            report = import_products(shop_id, shop.owner_id, iter_import_rows(stream, fmt))
+    elapsed = time.perf_counter() - started
+    
+    for error in report['errors']:
+        print(f"❌ row {error['row']}: {error['error']}")
+    print(f"✅ {report['created']} created, {report['updated']} updated, "
+          f"{report['error_count']} errors in {elapsed:.2f}s")
+    if 'file_error' in report:
+        raise click.ClickException(f"Unreadable file: {report['file_error']}")
+
+
+
+# PART 8: ROUTES - SALES MANAGEMENT
+
+
+def sale_list_query(user):
+    """Sales the user may list: their own shops' for a vendor, all of them for an admin"""
+    if user.role == 'vendor':
+        return Sale.query.filter(Sale.shop_id.in_(owned_shops_subquery(user)))
+    return Sale.query
+
+
+@app.route('/sales')
+@login_required
+def sales():
+    try:
+        page, next_cursor = keyset_page(sale_list_query(current_user), Sale.created_at, Sale.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if wants_json():
+        return page_json(page, next_cursor)
+    
+    return render_template('sales.html', sales=page, next_cursor=next_cursor)
+
+
+def sale_item_quantities(items):
+    """Total requested quantity per product across a sale's line items"""
+    quantities = {}
+    for item in items:
+        product_id = int(item['product_id'])
+        quantities[product_id] = quantities.get(product_id, 0) + int(item['quantity'])
+    return quantities
+
+
+def load_sale_products(product_ids):
+    """Load all line-item products in one query, locking the rows on PostgreSQL"""
+    query = Product.query.filter(Product.id.in_(product_ids))
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update()
+    return {product.id: product for product in query.all()}
+
+
+def find_short_items(quantities, products, shop_id):
+    """List line items that are unknown, belong to another shop or lack stock"""
+    short_items = []
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is not None and product.shop_id != shop_id:
+            product = None
+        if product is None or product.quantity < quantity:
+            short_items.append({
+                'product_id': product_id,
+                'name': product.name if product else None,
+                'requested': quantity,
+                'available': product.quantity if product else 0
+            })
+    return short_items
+
+
+def short_items_message(short_items):
+    return '; '.join(
+        f"Stock ya {item['name']} hazitosha" if item['name'] else f"Bidhaa {item['product_id']} haipo"
+        for item in short_items
+    )
+
+
+def decrement_stock(quantities, conditional=True):
+    """Decrement stock with one conditional UPDATE; False if any product ran short"""
+    if not quantities:
+        return True
+    
+    amount = db.case(quantities, value=Product.id)
+    condition = Product.id.in_(list(quantities))
+    if conditional:
+        condition = db.and_(condition, Product.quantity >= amount)
+    result = db.session.execute(
+        Product.__table__.update()
+        .where(condition)
+        .values(quantity=Product.quantity - amount, change_version=bump_product_change_versions(list(quantities)))
+    )
+    
+    # Loaded products now hold stale quantities
+    for product in db.session.identity_map.values():
+        if isinstance(product, Product) and product.id in quantities:
+            db.session.expire(product, ['quantity', 'updated_at', 'change_version'])
+    
+    return result.rowcount == len(quantities)
+
+
+@app.route('/sale/create', methods=['GET', 'POST'])
+@login_required
+@role_required(['vendor'])
+def create_sale():
+    if request.method == 'POST':
+        data = request.json
+        if not owns_shop(data['shop_id']):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        shop_id = int(data['shop_id'])
+        await_payment = bool(data.get('await_payment'))
+        if await_payment and data.get('payment_method') not in PAYMENT_PROVIDERS:
+            return jsonify({'error': f"await_payment needs payment_method {', '.join(PAYMENT_PROVIDERS)}"}), 400
+        quantities = sale_item_quantities(data['items'])
+        
+        # Validate every line item up front so all shortages are reported together
+        products = load_sale_products(list(quantities))
+        short_items = find_short_items(quantities, products, shop_id)
+        if short_items:
+            db.session.rollback()
+            return jsonify({'error': short_items_message(short_items), 'short_items': short_items}), 400
+        
+        # Generate sale number
+        sale_number = generate_number('SALE')
+        
+        sale = Sale(
+            sale_number=sale_number,
+            shop_id=shop_id,
+            customer_name=data.get('customer_name'),
+            customer_phone=data.get('customer_phone'),
+            total_amount=float(data['total_amount']),
+            payment_method=data.get('payment_method', 'cash'),
+            payment_reference=data.get('payment_reference'),
+            # Only an explicit await_payment opens a sale for /api/payment/initiate; a mobile
+            # money sale the vendor already collected is recorded as completed like cash
+            status='pending_payment' if await_payment else 'completed',
+            notes=data.get('notes'),
+            created_at=datetime.utcnow()
+        )
+        
+        db.session.add(sale)
+        db.session.flush()
+        
+        # Update inventory atomically; a concurrent sale may have taken the stock
+        if not decrement_stock(quantities):
+            db.session.rollback()
+            short_items = find_short_items(quantities, load_sale_products(list(quantities)), shop_id)
+            db.session.rollback()
+            return jsonify({'error': short_items_message(short_items), 'short_items': short_items}), 409
+        
+        db.session.add_all([
+            SaleItem(
+                sale_id=sale.id,
+                product_id=item['product_id'],
+                quantity=item['quantity'],
+                unit_price=item['unit_price'],
+                subtotal=item['subtotal']
+            )
+            for item in data['items']
+        ])
+        
+        record_daily_sale(sale.shop_id, sale.created_at, sale.total_amount,
+                          sum(quantities.values()))
+        record_product_sales([
+            dict(item, shop_id=sale.shop_id, sold_at=sale.created_at) for item in data['items']
+        ])
+        alerts = create_low_stock_alerts(current_user.id, list(quantities))
+        invalidate_analytics([sale.shop_id])
+        db.session.commit()
+        
+        emit_sale(sale)
+        emit_stock_levels(list(quantities))
+        emit_alerts(alerts)
+        
+        return jsonify({'success': True, 'sale_id': sale.id, 'sale_number': sale_number, 'status': sale.status})
+    
+    shops = vendor_shops_query(current_user.id).all()
+    return render_template('sale_create.html', shops=shops)
+
+
+CATALOG_FIELDS = ('id', 'name', 'price', 'quantity', 'unit', 'thumbnail')
+CATALOG_FORMATS = ('rows', 'columns')
+
+catalog_cache = TTLCache(app.config['CATALOG_CACHE_SIZE'], app.config['CATALOG_CACHE_TTL'])
+
+
+def catalog_version(shop_id):
+    """Highest change_version in the shop; every product write stamps a new, larger one"""
+    return db.session.query(db.func.coalesce(db.func.max(Product.change_version), 0)).filter(
+        Product.shop_id == shop_id
+    ).scalar()
+
+
+def build_catalog(shop_id, fmt):
+    """Serialize a shop's active products straight from column tuples"""
+    rows = [
+        row[:-1] + (thumbnail_url(row[-1]) if row[-1] else None,)
+        for row in db.session.query(
+            Product.id, Product.name, Product.price, Product.quantity, Product.unit, Product.image_hash
+        ).filter(Product.shop_id == shop_id, Product.is_active == True).order_by(Product.id)
+    ]
+    
+    if fmt == 'columns':
+        payload = {name: list(values) for name, values in zip(CATALOG_FIELDS, zip(*rows))} if rows else \
+            {name: [] for name in CATALOG_FIELDS}
+    else:
+        payload = [dict(zip(CATALOG_FIELDS, row)) for row in rows]
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def preferred_encoding(body):
+    if len(body) <= 1024:
+        return None
+    if request.accept_encodings['br']:
+        try:
+            import brotli  # optional dependency
+            return 'br'
+        except ImportError:
+            pass
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+@app.route('/api/shop/<int:shop_id>/products')
+@login_required
+def get_shop_products(shop_id):
+    if not owns_shop(shop_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    fmt = request.args.get('format', 'rows')
+    if fmt not in CATALOG_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(CATALOG_FORMATS)}"}), 400
+    
+    version = catalog_version(shop_id)
+    etag = f'catalog-{shop_id}-{version}-{fmt}'
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    entry = catalog_cache.get((shop_id, fmt))
+    if entry is None or entry['version'] != version:
+        entry = {'version': version, 'identity': build_catalog(shop_id, fmt)}
+        catalog_cache.set((shop_id, fmt), entry)
+    
+    encoding = preferred_encoding(entry['identity'])
+    if encoding and encoding not in entry:
+        entry[encoding] = compress_body(entry['identity'], encoding)
+    
+    response = app.response_class(entry[encoding or 'identity'], mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+
+# PART 8B: PRODUCT SEARCH
+
+
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+SEARCH_COLUMNS = ('id', 'name', 'sku', 'barcode', 'category', 'price', 'quantity', 'unit')
+
+
+def ensure_product_search_index(connection):
+    """Create the full-text index over product name/description/category; returns True if created"""
+    dialect = connection.dialect.name
+    
+    if dialect == 'sqlite':
+        if db.inspect(connection).has_table('products_fts'):
+            return False
+        connection.execute(db.text(
+            "CREATE VIRTUAL TABLE products_fts USING fts5("
+            "name, description, category, content='products', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+        # External-content FTS tables are kept in sync by triggers, so ORM writes,
+        # bulk imports and raw SQL all update the index
+        connection.execute(db.text(
+            "CREATE TRIGGER products_fts_insert AFTER INSERT ON products BEGIN "
+            "INSERT INTO products_fts(rowid, name, description, category) "
+            "VALUES (new.id, new.name, new.description, new.category); END"
+        ))
+        connection.execute(db.text(
+            "CREATE TRIGGER products_fts_delete AFTER DELETE ON products BEGIN "
+            "INSERT INTO products_fts(products_fts, rowid, name, description, category) "
+            "VALUES ('delete', old.id, old.name, old.description, old.category); END"
+        ))
+        connection.execute(db.text(
+            "CREATE TRIGGER products_fts_update AFTER UPDATE OF name, description, category ON products BEGIN "
+            "INSERT INTO products_fts(products_fts, rowid, name, description, category) "
+            "VALUES ('delete', old.id, old.name, old.description, old.category); "
+            "INSERT INTO products_fts(rowid, name, description, category) "
+            "VALUES (new.id, new.name, new.description, new.category); END"
+        ))
+        connection.execute(db.text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+        return True
+    
+    if dialect == 'postgresql':
+        if 'ix_products_search' in {index['name'] for index in db.inspect(connection).get_indexes('products')}:
+            return False
+        connection.execute(db.text(
+            f"CREATE INDEX ix_products_search ON products USING gin ({product_tsvector_sql()})"
+        ))
+        return True
+    
+    return False
+
+
+def product_tsvector_sql():
+    return "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(category, ''))"
+
+
+def search_product_rows(query):
+    return [dict(zip(SEARCH_COLUMNS, row)) for row in query]
+
+
+def find_products_by_code(shop_id, code):
+    """Exact barcode or SKU matches; one indexed lookup per column instead of an OR scan"""
+    columns = [getattr(Product, name) for name in SEARCH_COLUMNS]
+    rows = []
+    for code_column in (Product.barcode, Product.sku):
+        rows += search_product_rows(db.session.query(*columns).filter(
+            Product.shop_id == shop_id, code_column == code, Product.is_active == True
+        ))
+    return rows
+
+
+def search_products(shop_id, text, limit=SEARCH_LIMIT_DEFAULT):
+    """Ranked product search: exact barcode/SKU, then name prefix, then full-text matches"""
+    columns = [getattr(Product, name) for name in SEARCH_COLUMNS]
+    in_shop = db.and_(Product.shop_id == shop_id, Product.is_active == True)
+    results = []
+    seen = set()
+    
+    def collect(rows, match):
+        for row in rows:
+            if row['id'] not in seen and len(results) < limit:
+                seen.add(row['id'])
+                results.append({**row, 'match': match})
+    
+    collect(find_products_by_code(shop_id, text), 'code')
+    
+    prefix = text.lower()
+    name_key = db.func.lower(Product.name)
+    if len(results) < limit:
+        collect(search_product_rows(db.session.query(*columns).filter(
+            in_shop, name_key >= prefix, name_key < prefix + '\uffff'
+        ).order_by(name_key).limit(limit)), 'prefix')
+    
+    tokens = re.findall(r'\w+', prefix)
+    if len(results) < limit and tokens:
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            match = ' '.join(f'"{token}"*' for token in tokens)
+            fts_rows = db.session.execute(db.text(
+                f"SELECT {', '.join('p.' + name for name in SEARCH_COLUMNS)} FROM products_fts "
+                "JOIN products p ON p.id = products_fts.rowid "
+                "WHERE products_fts MATCH :match AND p.shop_id = :shop_id AND p.is_active = 1 "
+                "ORDER BY bm25(products_fts) LIMIT :limit"
+            ), {'match': match, 'shop_id': shop_id, 'limit': limit})
+        elif dialect == 'postgresql':
+            match = ' & '.join(f'{token}:*' for token in tokens)
+            fts_rows = db.session.execute(db.text(
+                f"SELECT {', '.join(SEARCH_COLUMNS)} FROM products "
+                f"WHERE {product_tsvector_sql()} @@ to_tsquery('simple', :match) "
+                "AND shop_id = :shop_id AND is_active "
+                f"ORDER BY ts_rank({product_tsvector_sql()}, to_tsquery('simple', :match)) DESC LIMIT :limit"
+            ), {'match': match, 'shop_id': shop_id, 'limit': limit})
+        else:
+            pattern = f'%{prefix}%'
+            fts_rows = db.session.query(*columns).filter(
+                in_shop, db.or_(name_key.like(pattern), db.func.lower(Product.category).like(pattern))
+            ).limit(limit)
+        collect(search_product_rows(fts_rows), 'text')
+    
+    return results
+
+
+@app.route('/api/shop/<int:shop_id>/products/search')
+@login_required
+def search_shop_products(shop_id):
+    """Search a shop's active products by barcode, SKU, name prefix or text"""
+    if not owns_shop(shop_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_LIMIT_DEFAULT)), SEARCH_LIMIT_MAX)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    
+    return jsonify({'results': search_products(shop_id, text, max(limit, 1))})
+
+
+@app.route('/api/shop/<int:shop_id>/products/lookup')
+@login_required
+def lookup_shop_product(shop_id):
+    """Exact barcode/SKU lookup for point-of-sale scanners"""
+    if not owns_shop(shop_id):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    code = request.args.get('code', '').strip()
+    if not code:
+        return jsonify({'error': 'code is required'}), 400
+    
+    rows = find_products_by_code(shop_id, code)
+    if not rows:
+        return jsonify({'error': 'Product not found'}), 404
+    return jsonify(rows[0])
 
 
 
 # PART 9: ROUTES - EXPENSE MANAGEMENT
 
 
+def expense_list_query(user):
+    return Expense.query.filter_by(user_id=user.id)
+
+
 @app.route('/expenses')
 @login_required
 def expenses():
-    all_expenses = Expense.query.filter_by(user_id=current_user.id).order_by(
-        Expense.date.desc()
-    ).all()
+    try:
+        page, next_cursor = keyset_page(expense_list_query(current_user), Expense.date, Expense.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if wants_json():
+        return page_json(page, next_cursor)
     
     # Calculate totals by category
     categories = db.session.query(
@@ -618,7 +2269,7 @@ def expenses():
         db.func.sum(Expense.amount).label('total')
     ).filter_by(user_id=current_user.id).group_by(Expense.category).all()
     
-    return render_template('expenses.html', expenses=all_expenses, categories=categories)
+    return render_template('expenses.html', expenses=page, categories=categories, next_cursor=next_cursor)
 
 
 @app.route('/expense/add', methods=['GET', 'POST'])
@@ -639,6 +2290,7 @@ def add_expense():
         )
         
         db.session.add(expense)
+        bump_metrics({'expenses': expense.amount})
         db.session.commit()
         
         flash('Gharama imeongezwa kikamilifu!', 'success')
@@ -657,104 +2309,441 @@ def reports():
     return render_template('reports.html')
 
 
+analytics_cache = TTLCache(app.config['ANALYTICS_CACHE_SIZE'], app.config['ANALYTICS_CACHE_TTL'])
+analytics_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def invalidate_analytics(shop_ids):
+    """Bump the change counters of the shops' vendors in the current transaction so cached analytics miss
+    
+    The generation lives in the database, so every worker process sees it once the write commits.
+    """
+    table = SyncVersion.__table__
+    owners = db.select(Shop.owner_id).where(Shop.id.in_(set(shop_ids)))
+    db.session.execute(table.update().where(table.c.id.in_(owners)).values(value=table.c.value + 1))
+    analytics_cache_stats['invalidations'] += 1
+
+
+def analytics_generation():
+    """The vendor's change counter, or the sum of every vendor's counter for the platform-wide admin scope"""
+    table = SyncVersion.__table__
+    if current_user.role == 'vendor':
+        return db.session.execute(db.select(table.c.value).where(table.c.id == current_user.id)).scalar() or 0
+    return db.session.execute(db.select(db.func.coalesce(db.func.sum(table.c.value), 0))).scalar()
+
+
+def analytics_cache_key(endpoint):
+    return (current_user.id, current_user.role, analytics_generation(), endpoint,
+            tuple(sorted(request.args.items(multi=True))))
+
+
+def cached_analytics(f):
+    """Serve identical analytics requests from the response cache until a write invalidates them"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = analytics_cache_key(f.__name__)
+        cached = analytics_cache.get(key)
+        if cached is not None:
+            analytics_cache_stats['hits'] += 1
+            body, mimetype = cached
+            response = app.response_class(body, mimetype=mimetype)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        
+        analytics_cache_stats['misses'] += 1
+        response = app.make_response(f(*args, **kwargs))
+        if response.status_code == 200:
+            analytics_cache.set(key, (response.get_data(), response.mimetype))
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return decorated_function
+
+
+@app.route('/api/analytics/cache-stats')
+@login_required
+@role_required(['admin'])
+def analytics_cache_metrics():
+    lookups = analytics_cache_stats['hits'] + analytics_cache_stats['misses']
+    return jsonify(dict(
+        analytics_cache_stats,
+        entries=len(analytics_cache),
+        hit_rate=analytics_cache_stats['hits'] / lookups if lookups else 0
+    ))
+
+
+ANALYTICS_GRANULARITIES = ('hour', 'day', 'week', 'month')
+ANALYTICS_MAX_BUCKETS = 10000
+
+
+def parse_naive_utc(value):
+    """Parse an ISO datetime, converting any UTC offset to the naive UTC the database stores"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_date_arg(value, end_of_day=False):
+    """Parse an ISO date/datetime query argument; date-only ends are inclusive"""
+    if not value:
+        return None
+    parsed = parse_naive_utc(value)
+    if end_of_day and len(value) <= 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def sql_date_bucket(column, granularity):
+    """SQL expression labelling a date/datetime column with its bucket start"""
+    if db.engine.dialect.name == 'postgresql':
+        fmt = 'YYYY-MM-DD HH24:00' if granularity == 'hour' else 'YYYY-MM-DD'
+        return db.func.to_char(db.func.date_trunc(granularity, column), fmt)
+    
+    if granularity == 'hour':
+        return db.func.strftime('%Y-%m-%d %H:00', column)
+    if granularity == 'week':
+        return db.func.date(column, 'weekday 0', '-6 days')
+    if granularity == 'month':
+        return db.func.strftime('%Y-%m-01', column)
+    return db.func.date(column)
+
+
+def bucket_start(moment, granularity):
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = datetime.combine(moment.date(), datetime.min.time())
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(moment, granularity):
+    if granularity == 'hour':
+        return moment + timedelta(hours=1)
+    if granularity == 'week':
+        return moment + timedelta(days=7)
+    if granularity == 'month':
+        return (moment + timedelta(days=32)).replace(day=1)
+    return moment + timedelta(days=1)
+
+
+def bucket_label(moment, granularity):
+    return moment.strftime('%Y-%m-%d %H:00' if granularity == 'hour' else '%Y-%m-%d')
+
+
 @app.route('/api/analytics/sales')
 @login_required
+@cached_analytics
 def analytics_sales():
     period = request.args.get('period', '7days')
+    granularity = request.args.get('granularity', 'day')
     
-    if period == '7days':
-        start_date = datetime.utcnow() - timedelta(days=7)
-    elif period == '30days':
-        start_date = datetime.utcnow() - timedelta(days=30)
-    else:
-        start_date = datetime.utcnow() - timedelta(days=365)
+    if granularity not in ANALYTICS_GRANULARITIES:
+        return jsonify({'error': 'Invalid granularity'}), 400
     
-    # Get sales data
-    if current_user.role == 'vendor':
-        shops = Shop.query.filter_by(owner_id=current_user.id).all()
-        shop_ids = [s.id for s in shops]
-        sales = Sale.query.filter(
-            Sale.shop_id.in_(shop_ids),
-            Sale.created_at >= start_date
-        ).all()
-    else:
-        sales = Sale.query.filter(Sale.created_at >= start_date).all()
+    try:
+        end_date = parse_date_arg(request.args.get('end'), end_of_day=True) or datetime.utcnow()
+        start_date = parse_date_arg(request.args.get('start'))
+    except ValueError:
+        return jsonify({'error': 'Invalid date'}), 400
+    
+    if start_date is None:
+        if period == '7days':
+            start_date = end_date - timedelta(days=7)
+        elif period == '30days':
+            start_date = end_date - timedelta(days=30)
+        else:
+            start_date = end_date - timedelta(days=365)
     
-    # Group by date
-    daily_sales = {}
-    for sale in sales:
-        date_key = sale.created_at.strftime('%Y-%m-%d')
-        daily_sales[date_key] = daily_sales.get(date_key, 0) + sale.total_amount
+    if start_date >= end_date:
+        return jsonify({'error': 'start must be before end'}), 400
+    
+    # Build the dense list of buckets first so empty periods show as zero
+    buckets = []
+    last_bucket = bucket_start(end_date - timedelta(microseconds=1), granularity)
+    current = bucket_start(start_date, granularity)
+    while current <= last_bucket:
+        buckets.append(bucket_label(current, granularity))
+        if len(buckets) > ANALYTICS_MAX_BUCKETS:
+            return jsonify({'error': 'Too many buckets, use a coarser granularity'}), 400
+        current = next_bucket(current, granularity)
+    
+    totals = {label: float(total or 0) for label, total in sales_trend_query(
+        current_user, start_date, end_date, granularity
+    ).all()}
     
     return jsonify({
-        'labels': list(daily_sales.keys()),
-        'data': list(daily_sales.values())
+        'granularity': granularity,
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'labels': buckets,
+        'data': [totals.get(label, 0) for label in buckets]
     })
 
 
+def sales_trend_query(user, start_date, end_date, granularity):
+    """(bucket label, revenue) rows between start_date and end_date, limited to a vendor's own shops"""
+    # Hourly buckets need raw sales; coarser ones come from the daily rollup
+    if granularity == 'hour':
+        bucket = sql_date_bucket(Sale.created_at, granularity)
+        query = db.session.query(bucket, db.func.sum(Sale.total_amount)).filter(
+            Sale.created_at >= start_date,
+            Sale.created_at < end_date,
+            Sale.status != VOID_SALE_STATUS
+        )
+        shop_column = Sale.shop_id
+    else:
+        bucket = sql_date_bucket(ShopDailySales.day, granularity)
+        query = db.session.query(bucket, db.func.sum(ShopDailySales.revenue)).filter(
+            ShopDailySales.day >= start_date.date(),
+            ShopDailySales.day <= (end_date - timedelta(microseconds=1)).date()
+        )
+        shop_column = ShopDailySales.shop_id
+    
+    if user.role == 'vendor':
+        query = query.filter(shop_column.in_(owned_shops_subquery(user)))
+    return query.group_by(bucket)
+
+
 @app.route('/api/analytics/top-products')
 @login_required
+@cached_analytics
 def analytics_top_products():
-    if current_user.role == 'vendor':
-        shops = Shop.query.filter_by(owner_id=current_user.id).all()
-        shop_ids = [s.id for s in shops]
-        
-        top_products = db.session.query(
-            Product.name,
-            db.func.sum(SaleItem.quantity).label('total_sold')
-        ).join(SaleItem).join(Sale).filter(
-            Sale.shop_id.in_(shop_ids)
-        ).group_by(Product.name).order_by(
-            db.desc('total_sold')
-        ).limit(10).all()
+    period = request.args.get('period', 'all')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    
+    # All-time rankings read the running counters; windows sum the per-day buckets
+    if period == 'all':
+        units_sold = db.func.coalesce(Product.units_sold, 0)
+        revenue = db.func.coalesce(Product.revenue, 0)
+        query = db.session.query(
+            Product.id, Product.name, Product.shop_id, Product.cost_price, units_sold, revenue
+        ).filter(units_sold > 0)
+        shop_column = Product.shop_id
     else:
-        top_products = db.session.query(
-            Product.name,
-            db.func.sum(SaleItem.quantity).label('total_sold')
-        ).join(SaleItem).group_by(Product.name).order_by(
-            db.desc('total_sold')
-        ).limit(10).all()
+        days = {'7days': 7, '30days': 30}.get(period, 365)
+        start_date = datetime.utcnow().date() - timedelta(days=days)
+        units_sold = db.func.sum(ProductDailySales.units_sold)
+        revenue = db.func.sum(ProductDailySales.revenue)
+        query = db.session.query(
+            Product.id, Product.name, Product.shop_id, Product.cost_price, units_sold, revenue
+        ).join(ProductDailySales, ProductDailySales.product_id == Product.id).filter(
+            ProductDailySales.day >= start_date
+        ).group_by(Product.id, Product.name, Product.shop_id, Product.cost_price)
+        shop_column = ProductDailySales.shop_id
+    
+    if current_user.role == 'vendor':
+        query = query.filter(shop_column.in_(owned_shops_subquery()))
+    
+    top_products = query.order_by(units_sold.desc()).limit(limit).all()
+    
+    products = [{
+        'id': product_id,
+        'name': name,
+        'shop_id': shop_id,
+        'units_sold': int(units),
+        'revenue': float(amount),
+        'margin': float(amount) - int(units) * cost_price if cost_price is not None else None
+    } for product_id, name, shop_id, cost_price, units, amount in top_products]
     
     return jsonify({
-        'labels': [p[0] for p in top_products],
-        'data': [float(p[1]) for p in top_products]
+        'labels': [p['name'] for p in products],
+        'data': [float(p['units_sold']) for p in products],
+        'products': products
     })
 
 
+REPORT_BATCH_SIZE = 1000
+
+# Report definitions: CSV header, selected columns and how each report is scoped
+REPORT_EXPORTS = {
+    'sales': {
+        'header': ['Sale Number', 'Date', 'Customer', 'Amount', 'Payment Method'],
+        'columns': (Sale.sale_number, Sale.created_at, db.func.coalesce(Sale.customer_name, 'N/A'),
+                    Sale.total_amount, Sale.payment_method),
+        'filters': (Sale.status != VOID_SALE_STATUS,),
+        'id_column': Sale.id,
+        'date_column': Sale.created_at,
+        'shop_column': Sale.shop_id
+    },
+    'sale_items': {
+        'header': ['Sale Number', 'Date', 'Product', 'Quantity', 'Unit Price', 'Subtotal'],
+        'columns': (Sale.sale_number, Sale.created_at, Product.name,
+                    SaleItem.quantity, SaleItem.unit_price, SaleItem.subtotal),
+        'joins': ((Sale, SaleItem.sale_id == Sale.id), (Product, SaleItem.product_id == Product.id)),
+        'filters': (Sale.status != VOID_SALE_STATUS,),
+        'id_column': SaleItem.id,
+        'date_column': Sale.created_at,
+        'shop_column': Sale.shop_id
+    },
+    'products': {
+        'header': ['Name', 'SKU', 'Barcode', 'Category', 'Price', 'Cost Price', 'Quantity',
+                   'Unit', 'Reorder Level', 'Shop ID'],
+        'columns': (Product.name, Product.sku, Product.barcode, Product.category, Product.price,
+                    Product.cost_price, Product.quantity, Product.unit, Product.reorder_level,
+                    Product.shop_id),
+        'id_column': Product.id,
+        'date_column': Product.created_at,
+        'shop_column': Product.shop_id
+    },
+    'expenses': {
+        'header': ['Date', 'Category', 'Amount', 'Description', 'Payment Method', 'Receipt Number'],
+        'columns': (Expense.date, Expense.category, Expense.amount, Expense.description,
+                    Expense.payment_method, Expense.receipt_number),
+        'id_column': Expense.id,
+        'date_column': Expense.date,
+        'user_column': Expense.user_id
+    },
+    'orders': {
+        'header': ['Order Number', 'Date', 'Supplier', 'Status', 'Amount', 'Delivery Date'],
+        'columns': (Order.order_number, Order.created_at, Supplier.name, Order.status,
+                    Order.total_amount, Order.delivery_date),
+        'joins': ((Supplier, Order.supplier_id == Supplier.id),),
+        'id_column': Order.id,
+        'date_column': Order.created_at,
+        'user_column': Order.buyer_id
+    }
+}
+
+
+def iter_report_batches(query, id_column, batch_size=REPORT_BATCH_SIZE):
+    """Yield report rows in keyset-paginated batches so memory stays constant"""
+    last_id = 0
+    while True:
+        batch = query.filter(id_column > last_id).order_by(id_column).limit(batch_size).all()
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        yield [row[1:] for row in batch]
+        if len(batch) < batch_size:
+            return
+
+
+def format_report_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    if value is None:
+        return ''
+    return value
+
+
+def generate_csv(header, batches, compress=False):
+    """Encode batches of rows as CSV chunks, optionally gzip-compressed"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
+    
+    writer.writerow(header)
+    yield drain()
+    
+    for batch in batches:
+        writer.writerows([format_report_value(value) for value in row] for row in batch)
+        chunk = drain()
+        if chunk:
+            yield chunk
+    
+    if compressor:
+        yield compressor.flush()
+
+
+def build_report(report_type, args, user):
+    """Resolve a report export from query args for user; returns (header, batches, filename, compress)"""
+    spec = REPORT_EXPORTS.get(report_type)
+    if spec is None:
+        raise ValueError('Invalid report type')
+    
+    try:
+        start_date = parse_date_arg(args.get('start'))
+        end_date = parse_date_arg(args.get('end'), end_of_day=True)
+        shop_filter = [int(shop_id) for shop_id in args.getlist('shop_id')]
+    except ValueError:
+        raise ValueError('Invalid filter')
+    compress = args.get('gzip') in ('1', 'true')
+    
+    query = db.session.query(spec['id_column'], *spec['columns'])
+    for model, condition in spec.get('joins', ()):
+        query = query.join(model, condition)
+    query = query.filter(*spec.get('filters', ()))
+    
+    shop_column = spec.get('shop_column')
+    if 'user_column' in spec and user.role == 'vendor':
+        query = query.filter(spec['user_column'] == user.id)
+    if shop_column is not None:
+        if user.role == 'vendor':
+            query = query.filter(shop_column.in_(owned_shops_subquery(user)))
+        if shop_filter:
+            query = query.filter(shop_column.in_(shop_filter))
+    
+    date_column = spec['date_column']
+    date_only = isinstance(date_column.type, db.Date)
+    if start_date:
+        query = query.filter(date_column >= (start_date.date() if date_only else start_date))
+    if end_date:
+        query = query.filter(date_column < (end_date.date() if date_only else end_date))
+    
+    filename = f'{report_type}_report_{datetime.utcnow().strftime("%Y%m%d")}.csv'
+    if compress:
+        filename += '.gz'
+    
+    return spec['header'], iter_report_batches(query, spec['id_column']), filename, compress
+
+
+def report_folder():
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'], 'reports')
+
+
+@job_task('generate_report')
+def generate_report_job(user_id, report_type, args):
+    """Write a report export to disk for later download through the job API"""
+    user = db.session.get(User, user_id)
+    if user is None:
+        raise PermanentJobError('User no longer exists')
+    
+    header, batches, filename, compress = build_report(report_type, MultiDict(args), user)
+    os.makedirs(report_folder(), exist_ok=True)
+    stored_name = f"{generate_number('RPT')}_{filename}"
+    with open(os.path.join(report_folder(), stored_name + '.part'), 'wb') as report_file:
+        for chunk in generate_csv(header, batches, compress):
+            report_file.write(chunk)
+    os.replace(os.path.join(report_folder(), stored_name + '.part'), os.path.join(report_folder(), stored_name))
+    
+    return {
+        'file': stored_name,
+        'filename': filename,
+        'mimetype': 'application/gzip' if compress else 'text/csv'
+    }
+
+
 @app.route('/reports/download/<report_type>')
 @login_required
 def download_report(report_type):
-    if report_type == 'sales':
-        # Generate CSV
-        output = BytesIO()
-        writer = csv.writer(output)
-        writer.writerow(['Sale Number', 'Date', 'Customer', 'Amount', 'Payment Method'])
-        
-        if current_user.role == 'vendor':
-            shops = Shop.query.filter_by(owner_id=current_user.id).all()
-            shop_ids = [s.id for s in shops]
-            sales = Sale.query.filter(Sale.shop_id.in_(shop_ids)).all()
-        else:
-            sales = Sale.query.all()
-        
-        for sale in sales:
-            writer.writerow([
-                sale.sale_number,
-                sale.created_at.strftime('%Y-%m-%d %H:%M'),
-                sale.customer_name or 'N/A',
-                sale.total_amount,
-                sale.payment_method
-            ])
-        
-        output.seek(0)
-        return send_file(
-            output,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'sales_report_{datetime.utcnow().strftime("%Y%m%d")}.csv'
-        )
+    try:
+        header, batches, filename, compress = build_report(report_type, request.args, current_user)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if request.args.get('async') in ('1', 'true'):
+        # Very large exports: build the file in a worker and let the client poll the job
+        args = {key: values for key, values in request.args.lists() if key != 'async'}
+        job = enqueue_job('generate_report', {
+            'user_id': current_user.id, 'report_type': report_type, 'args': args
+        }, user_id=current_user.id)
+        db.session.commit()
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
     
-    return jsonify({'error': 'Invalid report type'}), 400
+    return Response(
+        stream_with_context(generate_csv(header, batches, compress)),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 
 
@@ -791,17 +2780,25 @@ def add_supplier():
     return render_template('supplier_add.html')
 
 
+def order_list_query(user):
+    """Orders the user may list: the ones they placed for a vendor, all of them for an admin"""
+    if user.role == 'vendor':
+        return Order.query.filter_by(buyer_id=user.id)
+    return Order.query
+
+
 @app.route('/orders')
 @login_required
 def orders():
-    if current_user.role == 'vendor':
-        all_orders = Order.query.filter_by(buyer_id=current_user.id).order_by(
-            Order.created_at.desc()
-        ).all()
-    else:
-        all_orders = Order.query.order_by(Order.created_at.desc()).all()
+    try:
+        page, next_cursor = keyset_page(order_list_query(current_user), Order.created_at, Order.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if wants_json():
+        return page_json(page, next_cursor)
     
-    return render_template('orders.html', orders=all_orders)
+    return render_template('orders.html', orders=page, next_cursor=next_cursor)
 
 
 @app.route('/order/create', methods=['GET', 'POST'])
@@ -811,7 +2808,7 @@ def create_order():
     if request.method == 'POST':
         data = request.json
         
-        order_number = f"ORD{datetime.utcnow().timestamp():.0f}"
+        order_number = generate_number('ORD')
         
         order = Order(
             order_number=order_number,
@@ -862,13 +2859,30 @@ def update_order_status(order_id):
 # PART 12: ROUTES - ALERTS & NOTIFICATIONS
 
 
+def alert_list_query(user):
+    return Alert.query.filter_by(user_id=user.id)
+
+
+def unread_alerts_query(user_id):
+    return Alert.query.filter_by(user_id=user_id, is_read=False)
+
+
+def recent_alerts_query(user_id, limit=5):
+    return unread_alerts_query(user_id).order_by(Alert.created_at.desc()).limit(limit)
+
+
 @app.route('/alerts')
 @login_required
 def alerts():
-    all_alerts = Alert.query.filter_by(user_id=current_user.id).order_by(
-        Alert.created_at.desc()
-    ).all()
-    return render_template('alerts.html', alerts=all_alerts)
+    try:
+        page, next_cursor = keyset_page(alert_list_query(current_user), Alert.created_at, Alert.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if wants_json():
+        return page_json(page, next_cursor)
+    
+    return render_template('alerts.html', alerts=page, next_cursor=next_cursor)
 
 
 @app.route('/alert/<int:alert_id>/read', methods=['POST'])
@@ -885,43 +2899,450 @@ def mark_alert_read(alert_id):
     return jsonify({'success': True})
 
 
+def missing_low_stock_alerts_query(user_id):
+    """Low active products of the vendor that have no unread low-stock alert yet"""
+    has_unread_alert = db.exists().where(
+        Alert.product_id == Product.id,
+        Alert.user_id == user_id,
+        Alert.alert_type == 'low_stock',
+        Alert.is_read == False
+    )
+    return db.session.query(Product.id, Product.name, Product.quantity, Product.unit).join(
+        Shop, Shop.id == Product.shop_id
+    ).filter(
+        Shop.owner_id == user_id,
+        Product.is_active == True,
+        Product.quantity <= Product.reorder_level,
+        ~has_unread_alert
+    )
+
+
+def create_low_stock_alerts(user_id, product_ids=None):
+    """Bulk-insert a low-stock alert for each low product that has no unread one"""
+    query = missing_low_stock_alerts_query(user_id)
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': user_id,
+        'title': 'Bidhaa zimepungua',
+        'message': f'{name} iko chini ya kiwango ({quantity} {unit})',
+        'alert_type': 'low_stock',
+        'product_id': product_id,
+        'is_read': False,
+        'created_at': now
+    } for product_id, name, quantity, unit in query.all()]
+    
+    if rows:
+        db.session.execute(Alert.__table__.insert(), rows)
+    return rows
+
+
+def create_expiry_alerts(user_id, within_days):
+    """Bulk-insert an expiry alert for each product expiring soon that has no unread one"""
+    has_unread_alert = db.exists().where(
+        Alert.product_id == Product.id,
+        Alert.user_id == user_id,
+        Alert.alert_type == 'expiry',
+        Alert.is_read == False
+    )
+    rows = db.session.query(Product.id, Product.name, Product.expiry_date).join(
+        Shop, Shop.id == Product.shop_id
+    ).filter(
+        Shop.owner_id == user_id,
+        Product.is_active == True,
+        Product.quantity > 0,
+        Product.expiry_date <= datetime.utcnow().date() + timedelta(days=within_days),
+        ~has_unread_alert
+    ).all()
+    
+    now = datetime.utcnow()
+    rows = [{
+        'user_id': user_id,
+        'title': 'Bidhaa zinakaribia kuisha muda',
+        'message': f'{name} itaisha muda tarehe {expiry_date.strftime("%d/%m/%Y")}',
+        'alert_type': 'expiry',
+        'product_id': product_id,
+        'is_read': False,
+        'created_at': now
+    } for product_id, name, expiry_date in rows]
+    
+    if rows:
+        db.session.execute(Alert.__table__.insert(), rows)
+    return rows
+
+
+def vendor_ids(user_id=None):
+    if user_id is not None:
+        return [user_id]
+    return [owner_id for (owner_id,) in db.session.query(Shop.owner_id).distinct()]
+
+
+@job_task('low_stock_scan')
+def low_stock_scan(user_id=None):
+    """Create low-stock alerts for one vendor, or for every vendor in the nightly run"""
+    created = 0
+    for vendor_id in vendor_ids(user_id):
+        alerts = create_low_stock_alerts(vendor_id)
+        db.session.commit()
+        emit_alerts(alerts)
+        created += len(alerts)
+    return {'alerts': created}
+
+
+@job_task('expiry_scan')
+def expiry_scan(user_id=None):
+    """Create alerts for stock expiring within EXPIRY_ALERT_DAYS"""
+    created = 0
+    for vendor_id in vendor_ids(user_id):
+        alerts = create_expiry_alerts(vendor_id, app.config['EXPIRY_ALERT_DAYS'])
+        db.session.commit()
+        emit_alerts(alerts)
+        created += len(alerts)
+    return {'alerts': created}
+
+
 @app.route('/api/check-alerts')
 @login_required
 def check_alerts():
-    # Check for low stock
-    if current_user.role == 'vendor':
-        shops = Shop.query.filter_by(owner_id=current_user.id).all()
+    # Read-only: low-stock alerts are raised wherever stock changes, and the scheduled scan sweeps the rest
+    unread_count = unread_alerts_query(current_user.id).count()
+    return jsonify({'unread_count': unread_count})
+
+
+
+# PART 12B: REAL-TIME NOTIFICATIONS
+
+
+@socketio.on('connect')
+def socket_connect():
+    """Join the user's room and one room per owned shop"""
+    if not current_user.is_authenticated:
+        return False
+    
+    join_room(f'user_{current_user.id}')
+    for (shop_id,) in db.session.query(Shop.id).filter_by(owner_id=current_user.id):
+        join_room(f'shop_{shop_id}')
+
+
+def emit_stock_levels(product_ids):
+    """Push current stock of the given products to their shop rooms"""
+    if not product_ids:
+        return
+    
+    rows = db.session.query(
+        Product.id, Product.shop_id, Product.name, Product.quantity,
+        Product.unit, Product.reorder_level
+    ).filter(Product.id.in_(product_ids)).all()
+    
+    for row in rows:
+        socketio.emit('stock_level', {
+            'id': row.id,
+            'shop_id': row.shop_id,
+            'name': row.name,
+            'quantity': row.quantity,
+            'unit': row.unit,
+            'reorder_level': row.reorder_level
+        }, to=f'shop_{row.shop_id}')
+
+
+def emit_alerts(alerts):
+    """Push newly created alert rows to their owners"""
+    for alert in alerts:
+        socketio.emit('alert', {
+            'title': alert['title'],
+            'message': alert['message'],
+            'alert_type': alert['alert_type'],
+            'product_id': alert['product_id'],
+            'created_at': alert['created_at'].isoformat()
+        }, to=f"user_{alert['user_id']}")
+
+
+def emit_sale(sale):
+    socketio.emit('new_sale', {
+        'sale_id': sale.id,
+        'sale_number': sale.sale_number,
+        'shop_id': sale.shop_id,
+        'total_amount': sale.total_amount,
+        'created_at': sale.created_at.isoformat()
+    }, to=f'shop_{sale.shop_id}')
+
+
+
+# PART 13: ROUTES - OFFLINE SYNC
+
+
+SYNC_BATCH_MAX_RECORDS = 1000
+SYNC_CHUNK_SIZE = 100
+SYNC_SAVE_ERROR = 'Record could not be saved'  # details stay in the server log
+
+
+def build_sync_record(record, user, products):
+    """Turn one offline record into an unsaved Sale or Expense; raises ValueError if invalid"""
+    payload = record['payload']
+    
+    if record['type'] == 'sale':
+        shop_id = int(payload['shop_id'])
+        if not user_owns_shop(user, shop_id):
+            raise ValueError('Unknown shop')
         
-        for shop in shops:
-            products = Product.query.filter_by(shop_id=shop.id, is_active=True).all()
-            
-            for product in products:
-                if product.quantity <= product.reorder_level:
-                    # Check if alert already exists
-                    existing_alert = Alert.query.filter_by(
-                        user_id=current_user.id,
-                        alert_type='low_stock',
-                        message__contains=product.name,
-                        is_read=False
-                    ).first()
-                    
-                    if not existing_alert:
-                        alert = Alert(
-                            user_id=current_user.id,
-                            title='Bidhaa zimepungua',
-                            message=f'{product.name} iko chini ya kiwango ({product.quantity} {product.unit})',
-                            alert_type='low_stock'
-                        )
-                        db.session.add(alert)
+        items = []
+        for item in payload['items']:
+            product = products.get(int(item['product_id']))
+            if product is None or product.shop_id != shop_id:
+                raise ValueError(f"Unknown product {item['product_id']}")
+            items.append(SaleItem(
+                product_id=product.id,
+                quantity=int(item['quantity']),
+                unit_price=float(item['unit_price']),
+                subtotal=float(item['subtotal'])
+            ))
         
+        # The client UUID makes the sale number stable across retries
+        return Sale(
+            sale_number=f"SALE{uuid.UUID(record['client_id']).hex.upper()}",
+            shop_id=shop_id,
+            customer_name=payload.get('customer_name'),
+            total_amount=float(payload['total_amount']),
+            payment_method=payload.get('payment_method', 'cash'),
+            created_at=parse_naive_utc(payload['created_at']) if payload.get('created_at') else datetime.utcnow(),
+            items=items
+        )
+    
+    if record['type'] == 'expense':
+        return Expense(
+            user_id=user.id,
+            category=payload['category'],
+            amount=float(payload['amount']),
+            description=payload.get('description'),
+            date=datetime.fromisoformat(payload['date']).date()
+        )
+    
+    raise ValueError('Invalid record type')
+
+
+def sync_sale_product_ids(records):
+    product_ids = set()
+    for record in records:
+        try:
+            if record['type'] == 'sale':
+                product_ids.update(int(item['product_id']) for item in record['payload']['items'])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return list(product_ids)
+
+
+def book_sync_records(built, user):
+    """Insert built offline records with their stock, rollup, metrics and sync-log rows; returns (stocked product IDs, alerts)"""
+    db.session.add_all([obj for _, _, obj in built])
+    db.session.flush()
+    
+    # Offline sales already happened, so stock is decremented unconditionally
+    quantities = {}
+    daily = {}
+    for _, _, obj in built:
+        if isinstance(obj, Sale):
+            item_count = 0
+            for item in obj.items:
+                quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+                item_count += item.quantity
+            key = (obj.shop_id, obj.created_at.date())
+            revenue, sale_count, items = daily.get(key, (0, 0, 0))
+            daily[key] = (revenue + obj.total_amount, sale_count + 1, items + item_count)
+    
+    decrement_stock(quantities, conditional=False)
+    record_product_sales([{
+        'product_id': item.product_id,
+        'shop_id': obj.shop_id,
+        'sold_at': obj.created_at,
+        'quantity': item.quantity,
+        'subtotal': item.subtotal
+    } for _, _, obj in built if isinstance(obj, Sale) for item in obj.items])
+    for (shop_id, day), (revenue, sale_count, item_count) in daily.items():
+        record_daily_sale(shop_id, datetime.combine(day, datetime.min.time()),
+                          revenue, item_count, sale_count)
+    
+    expense_total = sum(obj.amount for _, _, obj in built if isinstance(obj, Expense))
+    if expense_total:
+        bump_metrics({'expenses': expense_total})
+    
+    now = datetime.utcnow()
+    db.session.execute(SyncLog.__table__.insert(), [{
+        'user_id': user.id,
+        'sync_type': record['type'],
+        'client_id': record['client_id'],
+        'record_id': obj.id,
+        'status': 'completed',
+        'created_at': now,
+        'synced_at': now
+    } for _, record, obj in built])
+    
+    alerts = create_low_stock_alerts(user.id, list(quantities)) if quantities else []
+    sale_shop_ids = [obj.shop_id for _, _, obj in built if isinstance(obj, Sale)]
+    if sale_shop_ids:
+        invalidate_analytics(sale_shop_ids)
+    return list(quantities), alerts
+
+
+def apply_sync_records_singly(entries, user, results):
+    """Retry a failed chunk with one savepoint per record, so one bad record cannot sink the rest"""
+    products = load_sale_products(sync_sale_product_ids([record for _, record in entries]))
+    built = []
+    product_ids = set()
+    alerts = []
+    
+    for index, record in entries:
+        try:
+            obj = build_sync_record(record, user, products)
+            with db.session.begin_nested():
+                record_product_ids, record_alerts = book_sync_records([(index, record, obj)], user)
+        except Exception as e:
+            # Usually a concurrent upload of the same client_id that committed first
+            existing = find_synced_records([record['client_id']])
+            if record['client_id'] in existing:
+                results[index] = sync_duplicate_result(record['client_id'], existing[record['client_id']], user)
+            else:
+                print(f"❌ Sync record {record['client_id']} failed: {e}")
+                results[index] = {'client_id': record['client_id'], 'status': 'error', 'error': SYNC_SAVE_ERROR}
+            continue
+        
+        built.append((index, record, obj))
+        product_ids.update(record_product_ids)
+        alerts += record_alerts
+    
+    db.session.commit()
+    return built, list(product_ids), alerts
+
+
+def apply_sync_chunk(chunk, user, results):
+    """Validate and insert one chunk of offline records in a single transaction"""
+    product_ids = sync_sale_product_ids([record for _, record in chunk])
+    products = load_sale_products(product_ids) if product_ids else {}
+    
+    built = []
+    for index, record in chunk:
+        try:
+            built.append((index, record, build_sync_record(record, user, products)))
+        except (KeyError, TypeError, ValueError) as e:
+            results[index] = {'client_id': record.get('client_id'), 'status': 'error', 'error': str(e)}
+    
+    if not built:
+        db.session.rollback()
+        return
+    
+    try:
+        stocked_ids, alerts = book_sync_records(built, user)
         db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Sync chunk of {len(built)} records failed, retrying one by one: {e}")
+        built, stocked_ids, alerts = apply_sync_records_singly(
+            [(index, record) for index, record, _ in built], user, results
+        )
     
-    unread_count = Alert.query.filter_by(user_id=current_user.id, is_read=False).count()
-    return jsonify({'unread_count': unread_count})
+    for index, record, obj in built:
+        results[index] = {'client_id': record['client_id'], 'status': 'created', 'id': obj.id}
+    
+    for sale in [obj for _, _, obj in built if isinstance(obj, Sale)]:
+        emit_sale(sale)
+    emit_stock_levels(stocked_ids)
+    emit_alerts(alerts)
 
 
+def find_synced_records(client_ids):
+    """Map already-synced client IDs to (record_id, user_id); client IDs are unique across all users"""
+    existing = {}
+    for i in range(0, len(client_ids), SYNC_CHUNK_SIZE):
+        existing.update((client_id, (record_id, user_id)) for client_id, record_id, user_id in db.session.query(
+            SyncLog.client_id, SyncLog.record_id, SyncLog.user_id
+        ).filter(SyncLog.client_id.in_(client_ids[i:i + SYNC_CHUNK_SIZE])))
+    return existing
 
-# PART 13: ROUTES - OFFLINE SYNC
+
+def sync_duplicate_result(client_id, synced, user):
+    record_id, owner_id = synced
+    if owner_id != user.id:
+        return {'client_id': client_id, 'status': 'error', 'error': 'client_id already used'}
+    return {'client_id': client_id, 'status': 'duplicate', 'id': record_id}
+
+
+def process_sync_records(records, user):
+    """Apply offline records in chunked transactions, skipping already-synced client IDs"""
+    results = [None] * len(records)
+    
+    client_ids = [r.get('client_id') for r in records if isinstance(r, dict) and r.get('client_id')]
+    existing = find_synced_records(client_ids)
+    
+    pending = []
+    first_seen = {}
+    repeats = []
+    for index, record in enumerate(records):
+        client_id = record.get('client_id') if isinstance(record, dict) else None
+        try:
+            client_id = str(uuid.UUID(str(client_id)))
+        except ValueError:
+            results[index] = {'client_id': client_id, 'status': 'error', 'error': 'Invalid client_id'}
+            continue
+        
+        if client_id in existing:
+            results[index] = sync_duplicate_result(client_id, existing[client_id], user)
+            continue
+        if client_id in first_seen:
+            repeats.append((index, first_seen[client_id]))
+            continue
+        
+        first_seen[client_id] = index
+        pending.append((index, dict(record, client_id=client_id)))
+    
+    for i in range(0, len(pending), SYNC_CHUNK_SIZE):
+        apply_sync_chunk(pending[i:i + SYNC_CHUNK_SIZE], user, results)
+    
+    # Repeats within the same batch mirror the outcome of the first occurrence
+    for index, first in repeats:
+        result = dict(results[first])
+        if result['status'] == 'created':
+            result['status'] = 'duplicate'
+        results[index] = result
+    
+    return results
+
+
+@app.route('/api/sync/batch', methods=['POST'])
+@login_required
+def sync_batch():
+    """Receive a batch of offline sales and expenses keyed by client UUIDs"""
+    records = (request.json or {}).get('records')
+    
+    if not isinstance(records, list):
+        return jsonify({'error': 'records must be a list'}), 400
+    if len(records) > SYNC_BATCH_MAX_RECORDS:
+        return jsonify({'error': f'At most {SYNC_BATCH_MAX_RECORDS} records per batch'}), 400
+    
+    if request.args.get('async') in ('1', 'true'):
+        job = enqueue_job('sync_batch', {'user_id': current_user.id, 'records': records}, user_id=current_user.id)
+        db.session.commit()
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    
+    return jsonify(sync_batch_summary(process_sync_records(records, current_user)))
+
+
+def sync_batch_summary(results):
+    return {
+        'results': results,
+        'created': sum(1 for r in results if r['status'] == 'created'),
+        'duplicates': sum(1 for r in results if r['status'] == 'duplicate'),
+        'errors': sum(1 for r in results if r['status'] == 'error')
+    }
+
+
+@job_task('sync_batch')
+def sync_batch_job(user_id, records):
+    """Apply a large offline batch in the background; client UUIDs make a retry safe"""
+    user = db.session.get(User, user_id)
+    if user is None:
+        raise PermanentJobError('User no longer exists')
+    return sync_batch_summary(process_sync_records(records, user))
 
 
 @app.route('/api/sync/upload', methods=['POST'])
@@ -929,102 +3350,97 @@ def check_alerts():
 def sync_upload():
     """Receive offline data and sync to database"""
     data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid record'}), 400
     
-    sync_log = SyncLog(
-        user_id=current_user.id,
-        sync_type=data['type'],
-        data=json.dumps(data['payload'])
-    )
+    # Older clients send no client UUID; mint one so every record takes the same validated,
+    # idempotent batch pipeline (the client can resend with it to retry safely)
+    record = dict(data, client_id=data.get('client_id') or str(uuid.uuid4()))
+    result = process_sync_records([record], current_user)[0]
+    if result['status'] == 'error':
+        return jsonify({'error': result['error'], 'client_id': result['client_id']}), 400
+    return jsonify({
+        'success': True,
+        'message': 'Data synced successfully',
+        'id': result['id'],
+        'client_id': result['client_id']
+    })
+
+
+def conditional_json(payload, etag):
+    """JSON response that honours If-None-Match and gzip Accept-Encoding"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
     
-    db.session.add(sync_log)
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
     
-    try:
-        if data['type'] == 'sale':
-            # Process offline sale
-            payload = data['payload']
-            
-            sale_number = f"SALE{datetime.utcnow().timestamp():.0f}"
-            
-            sale = Sale(
-                sale_number=sale_number,
-                shop_id=payload['shop_id'],
-                customer_name=payload.get('customer_name'),
-                total_amount=float(payload['total_amount']),
-                payment_method=payload.get('payment_method', 'cash'),
-                created_at=datetime.fromisoformat(payload.get('created_at', datetime.utcnow().isoformat()))
-            )
-            
-            db.session.add(sale)
-            db.session.flush()
-            
-            for item in payload['items']:
-                product = Product.query.get(item['product_id'])
-                
-                sale_item = SaleItem(
-                    sale_id=sale.id,
-                    product_id=item['product_id'],
-                    quantity=item['quantity'],
-                    unit_price=item['unit_price'],
-                    subtotal=item['subtotal']
-                )
-                
-                product.quantity -= item['quantity']
-                db.session.add(sale_item)
-        
-        elif data['type'] == 'expense':
-            payload = data['payload']
-            
-            expense = Expense(
-                user_id=current_user.id,
-                category=payload['category'],
-                amount=float(payload['amount']),
-                description=payload.get('description'),
-                date=datetime.fromisoformat(payload['date']).date()
-            )
-            
-            db.session.add(expense)
-        
-        sync_log.status = 'completed'
-        sync_log.synced_at = datetime.utcnow()
-        db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Data synced successfully'})
+    if len(body) > 1024 and request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
     
-    except Exception as e:
-        db.session.rollback()
-        sync_log.status = 'failed'
-        db.session.commit()
-        
-        return jsonify({'error': str(e)}), 500
+    return response
 
 
 @app.route('/api/sync/download')
 @login_required
 def sync_download():
     """Send latest data to client for offline use"""
-    if current_user.role == 'vendor':
-        shops = Shop.query.filter_by(owner_id=current_user.id).all()
-        shop_ids = [s.id for s in shops]
-        
-        products = Product.query.filter(Product.shop_id.in_(shop_ids), Product.is_active==True).all()
-        
-        return jsonify({
-            'shops': [{
-                'id': s.id,
-                'name': s.name,
-                'category': s.category
-            } for s in shops],
-            'products': [{
-                'id': p.id,
-                'name': p.name,
-                'price': p.price,
-                'quantity': p.quantity,
-                'shop_id': p.shop_id,
-                'unit': p.unit
-            } for p in products]
-        })
+    if current_user.role != 'vendor':
+        return jsonify({'shops': [], 'products': []})
+    
+    since = request.args.get('since', type=int)
+    shops = vendor_shops_query(current_user.id).all()
+    shop_ids = [s.id for s in shops]
+    
+    cursor = max(
+        [s.change_version or 0 for s in shops] +
+        [db.session.query(db.func.max(Product.change_version)).filter(
+            Product.shop_id.in_(shop_ids)
+        ).scalar() or 0]
+    )
+    
+    # Unchanged catalog: let the client keep its copy
+    etag = f'{current_user.id}-{since or 0}-{cursor}'
+    if request.if_none_match.contains(etag):
+        return conditional_json(None, etag)
+    
+    product_query = db.session.query(
+        Product.id, Product.name, Product.price, Product.quantity,
+        Product.shop_id, Product.unit, Product.is_active
+    ).filter(Product.shop_id.in_(shop_ids))
+    
+    if since:
+        changed_shops = [s for s in shops if (s.change_version or 0) > since]
+        changed_products = product_query.filter(Product.change_version > since).all()
+    else:
+        changed_shops = [s for s in shops if s.is_active is not False]
+        changed_products = product_query.filter(Product.is_active == True).all()
     
-    return jsonify({'shops': [], 'products': []})
+    return conditional_json({
+        'cursor': cursor,
+        'full': not since,
+        'shops': [{
+            'id': s.id,
+            'name': s.name,
+            'category': s.category
+        } for s in changed_shops if s.is_active is not False],
+        'products': [{
+            'id': p.id,
+            'name': p.name,
+            'price': p.price,
+            'quantity': p.quantity,
+            'shop_id': p.shop_id,
+            'unit': p.unit
+        } for p in changed_products if p.is_active],
+        'deleted_shops': [s.id for s in changed_shops if s.is_active is False],
+        'deleted_products': [p.id for p in changed_products if not p.is_active]
+    }, etag)
 
 
 
@@ -1044,49 +3460,350 @@ def settings():
             current_user.set_password(new_password)
         
         db.session.commit()
-        flash('Mipangilio imesasishwa!', 'success')
-        return redirect(url_for('settings'))
+        user_cache.invalidate(current_user.id)
+        flash('Mipangilio imesasishwa!', 'success')
+        return redirect(url_for('settings'))
+    
+    return render_template('settings.html')
+
+
+
+# PART 15: API ENDPOINTS - MOBILE MONEY
+
+
+PAYMENT_PROVIDERS = ('mpesa', 'tigopesa', 'airtel_money')
+PAYMENT_FINAL_STATES = ('confirmed', 'failed', 'expired')
+
+
+def payment_json(payment):
+    return {
+        'payment_reference': payment.reference,
+        'status': payment.status,
+        'provider': payment.provider,
+        'amount': payment.amount,
+        'sale_id': payment.sale_id,
+        'provider_reference': payment.provider_reference,
+        'created_at': payment.created_at.isoformat(),
+        'expires_at': payment.expires_at.isoformat()
+    }
+
+
+def transition_payment(payment, status, **fields):
+    """Move a pending payment to a final state exactly once; False if it already left pending"""
+    updated = Payment.query.filter(Payment.id == payment.id, Payment.status == 'pending').update(
+        {'status': status, 'updated_at': datetime.utcnow(), **fields}, synchronize_session=False
+    )
+    if not updated:
+        return False
+    
+    if payment.sale_id:
+        settled = Sale.query.filter_by(id=payment.sale_id, status='pending_payment').update(
+            {'status': 'completed' if status == 'confirmed' else VOID_SALE_STATUS}, synchronize_session=False
+        )
+        if settled and status != 'confirmed':
+            void_sale_bookings(payment.sale_id)
+    return True
+
+
+def sale_items_query(sale_id):
+    return SaleItem.query.filter_by(sale_id=sale_id)
+
+
+def void_sale_bookings(sale_id):
+    """Put back the stock and take back the rollup and ledger amounts create_sale booked"""
+    sale = db.session.get(Sale, sale_id)
+    items = sale_items_query(sale_id).all()
+    
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    # Negative amounts turn the decrement into a restock
+    decrement_stock({product_id: -quantity for product_id, quantity in quantities.items()}, conditional=False)
+    
+    record_daily_sale(sale.shop_id, sale.created_at, -sale.total_amount, -sum(quantities.values()), sale_count=-1)
+    record_product_sales([{
+        'product_id': item.product_id,
+        'shop_id': sale.shop_id,
+        'sold_at': sale.created_at,
+        'quantity': -item.quantity,
+        'subtotal': -item.subtotal
+    } for item in items])
+
+
+def emit_payment(payment):
+    socketio.emit('payment_status', payment_json(payment), to=f'user_{payment.user_id}')
+
+
+def finish_payment(payment, status, **fields):
+    """Apply a final state, commit and notify the payer; returns whether this call made the change"""
+    changed = transition_payment(payment, status, **fields)
+    voided = changed and payment.sale_id and status != 'confirmed'
+    if voided:
+        invalidate_analytics([db.session.get(Sale, payment.sale_id).shop_id])
+    db.session.commit()
+    db.session.refresh(payment)
+    if changed:
+        emit_payment(payment)
+        if voided:
+            sale = db.session.get(Sale, payment.sale_id)
+            emit_stock_levels([item.product_id for item in sale.items])
+    return changed
+
+
+def payment_provider_failed(error, payment_id, callback_url):
+    payment = db.session.get(Payment, payment_id)
+    if payment is not None:
+        finish_payment(payment, 'failed', last_error=payment.last_error or str(error)[:500])
+
+
+@job_task('call_payment_provider', attempts_config='PAYMENT_MAX_ATTEMPTS',
+          backoff_config='PAYMENT_RETRY_BACKOFF', on_failure=payment_provider_failed)
+def call_payment_provider(payment_id, callback_url):
+    """Ask the provider to push a payment prompt; transient failures are retried by the job queue"""
+    payment = db.session.get(Payment, payment_id)
+    if payment is None or payment.status != 'pending':
+        return None
+    
+    # The provider deduplicates on our reference, so a retry after a timeout cannot charge twice
+    body = json.dumps({
+        'reference': payment.reference,
+        'provider': payment.provider,
+        'phone': payment.phone,
+        'amount': payment.amount,
+        'callback_url': callback_url
+    }).encode('utf-8')
+    payment.attempts = (payment.attempts or 0) + 1
+    db.session.commit()
+    
+    try:
+        provider_request = urllib.request.Request(
+            f"{app.config['PAYMENT_PROVIDER_URL'].rstrip('/')}/payments", data=body,
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(provider_request, timeout=app.config['PAYMENT_PROVIDER_TIMEOUT']) as response:
+            result = json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as e:
+        payment.last_error = f'HTTP {e.code}'
+        db.session.commit()
+        if e.code < 500:
+            raise PermanentJobError(payment.last_error)  # rejected (bad number, limits...); retrying will not help
+        raise
+    except (urllib.error.URLError, TimeoutError, ValueError) as e:
+        payment.last_error = str(e)[:500]
+        db.session.commit()
+        raise
     
-    return render_template('settings.html')
+    payment.provider_reference = result.get('provider_reference')
+    db.session.commit()
+    return {'provider_reference': payment.provider_reference}
 
 
+def expire_stale_payments():
+    """Expire payments whose provider never called back; returns how many expired"""
+    stale = Payment.query.filter(Payment.status == 'pending', Payment.expires_at <= datetime.utcnow()).all()
+    return sum(finish_payment(payment, 'expired') for payment in stale)
 
-# PART 15: API ENDPOINTS - MOBILE MONEY
+
+def void_abandoned_sales():
+    """Void await_payment sales nobody requested a payment for within PAYMENT_EXPIRY"""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['PAYMENT_EXPIRY'])
+    abandoned = db.session.query(Sale.id, Sale.shop_id).filter(
+        Sale.status == 'pending_payment', Sale.created_at <= cutoff, Sale.payment_reference.is_(None)
+    ).all()
+    
+    voided = []
+    for sale_id, shop_id in abandoned:
+        # Conditional so a payment initiated meanwhile keeps its sale
+        if Sale.query.filter_by(id=sale_id, status='pending_payment', payment_reference=None).update(
+            {'status': VOID_SALE_STATUS}, synchronize_session=False
+        ):
+            void_sale_bookings(sale_id)
+            invalidate_analytics([shop_id])
+            voided.append(shop_id)
+        db.session.commit()
+    
+    return len(voided)
+
+
+def payment_signature(body):
+    return hmac.new(app.config['PAYMENT_CALLBACK_SECRET'].encode('utf-8'), body, hashlib.sha256).hexdigest()
 
 
 @app.route('/api/payment/initiate', methods=['POST'])
 @login_required
 def initiate_payment():
     """Initiate mobile money payment"""
-    data = request.json
-    
-    # This is a placeholder for actual mobile money API integration
-    # You would integrate with M-Pesa, TigoPesa, or Airtel Money APIs here
+    data = request.json or {}
     
     payment_method = data.get('payment_method')  # mpesa, tigopesa, airtel_money
     phone_number = data.get('phone_number')
-    amount = data.get('amount')
+    if payment_method not in PAYMENT_PROVIDERS:
+        return jsonify({'error': f"payment_method must be one of {', '.join(PAYMENT_PROVIDERS)}"}), 400
+    if not phone_number:
+        return jsonify({'error': 'phone_number is required'}), 400
+    
+    sale = None
+    if data.get('sale_id'):
+        sale = db.session.get(Sale, int(data['sale_id']))
+        if sale is None or not owns_shop(sale.shop_id):
+            return jsonify({'error': 'Sale not found'}), 404
+        if sale.status != 'pending_payment' or sale.payment_reference:
+            return jsonify({
+                'error': 'Sale is not awaiting payment',
+                'status': sale.status,
+                'payment_reference': sale.payment_reference
+            }), 409
+    
+    try:
+        amount = float(data['amount']) if data.get('amount') is not None else sale.total_amount
+    except (ValueError, AttributeError):
+        return jsonify({'error': 'amount is required'}), 400
+    if amount <= 0:
+        return jsonify({'error': 'amount must be positive'}), 400
     
-    # Simulate API call
-    payment_reference = f"PAY{datetime.utcnow().timestamp():.0f}"
+    payment = Payment(
+        reference=generate_number('PAY'),
+        sale_id=sale.id if sale else None,
+        user_id=current_user.id,
+        provider=payment_method,
+        phone=phone_number,
+        amount=amount,
+        expires_at=datetime.utcnow() + timedelta(seconds=app.config['PAYMENT_EXPIRY'])
+    )
+    db.session.add(payment)
+    if sale:
+        # A pending_payment sale carries a reference only while a payment for it is in flight
+        claimed = Sale.query.filter(
+            Sale.id == sale.id, Sale.status == 'pending_payment', Sale.payment_reference.is_(None)
+        ).update({'payment_method': payment_method, 'payment_reference': payment.reference},
+                 synchronize_session=False)
+        if not claimed:
+            db.session.rollback()
+            return jsonify({'error': 'Sale is not awaiting payment'}), 409
+    db.session.flush()
+    
+    # The provider round-trip takes seconds; never hold the web worker for it
+    enqueue_job('call_payment_provider', {
+        'payment_id': payment.id,
+        'callback_url': url_for('payment_callback', _external=True)
+    }, user_id=current_user.id)
+    db.session.commit()
     
     return jsonify({
         'success': True,
-        'payment_reference': payment_reference,
-        'status': 'pending',
+        **payment_json(payment),
         'message': 'Angalia simu yako kumaliza malipo'
-    })
+    }), 202
+
+
+@app.route('/api/payment/<reference>')
+@login_required
+def payment_status(reference):
+    payment = Payment.query.filter_by(reference=reference).first()
+    if payment is None or (payment.user_id != current_user.id and current_user.role != 'admin'):
+        return jsonify({'error': 'Payment not found'}), 404
+    
+    if payment.status == 'pending' and payment.expires_at <= datetime.utcnow():
+        finish_payment(payment, 'expired')
+    return jsonify(payment_json(payment))
 
 
 @app.route('/api/payment/callback', methods=['POST'])
 def payment_callback():
-    """Handle payment callback from mobile money provider"""
-    data = request.json
+    """Handle payment callback from mobile money provider; safe to deliver more than once"""
+    body = request.get_data()
+    if app.config['PAYMENT_CALLBACK_SECRET']:
+        signature = request.headers.get('X-Payment-Signature', '')
+        if not hmac.compare_digest(signature, payment_signature(body)):
+            return jsonify({'error': 'Invalid signature'}), 401
     
-    # Process payment confirmation
-    # Update sale status, create transaction record, etc.
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return jsonify({'error': 'Invalid JSON'}), 400
     
-    return jsonify({'success': True})
+    status = data.get('status')
+    if status not in ('confirmed', 'failed'):
+        return jsonify({'error': 'status must be confirmed or failed'}), 400
+    
+    payment = Payment.query.filter_by(reference=data.get('reference')).first()
+    if payment is None:
+        return jsonify({'error': 'Payment not found'}), 404
+    
+    fields = {'provider_reference': data['provider_reference']} if data.get('provider_reference') else {}
+    if status == 'failed':
+        fields['last_error'] = data.get('reason')
+    finish_payment(payment, status, **fields)
+    
+    if payment.status != status:
+        # A different final state was already recorded (e.g. expired before the provider answered)
+        return jsonify({'error': f'Payment already {payment.status}', 'status': payment.status}), 409
+    return jsonify({'success': True, 'status': payment.status})
+
+
+@app.cli.command('expire-payments')
+def expire_payments_command():
+    """Expire payments and void unpaid mobile money sales older than PAYMENT_EXPIRY"""
+    with app.app_context():
+        count = expire_stale_payments()
+        voided = void_abandoned_sales()
+    print(f"✅ Expired {count} payments, voided {voided} unpaid sales")
+
+
+@app.cli.command('payment-simulator')
+@click.option('--port', default=5055, help='Port matching PAYMENT_PROVIDER_URL')
+@click.option('--delay', default=2.0, help='Seconds before the simulated customer answers')
+@click.option('--failure-rate', default=0.1, help='Share of payments the customer declines')
+@click.option('--drop-rate', default=0.0, help='Share of payments that never get a callback')
+def payment_simulator_command(port, delay, failure_rate, drop_rate):
+    """Local stand-in for the mobile money provider, for development and load tests"""
+    import random
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    def send_callback(payload, callback_url):
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if app.config['PAYMENT_CALLBACK_SECRET']:
+            headers['X-Payment-Signature'] = payment_signature(body)
+        try:
+            urllib.request.urlopen(urllib.request.Request(callback_url, data=body, headers=headers, method='POST'), timeout=10).close()
+        except urllib.error.URLError as e:
+            print(f"❌ Callback for {payload['reference']} failed: {e}")
+    
+    class ProviderHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/payments':
+                self.send_error(404)
+                return
+            request_data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            provider_reference = f"SIM{uuid.uuid4().hex[:12].upper()}"
+            
+            if random.random() >= drop_rate:
+                declined = random.random() < failure_rate
+                payload = {
+                    'reference': request_data['reference'],
+                    'provider_reference': provider_reference,
+                    'status': 'failed' if declined else 'confirmed'
+                }
+                if declined:
+                    payload['reason'] = 'Customer declined'
+                timer = threading.Timer(delay, send_callback, (payload, request_data['callback_url']))
+                timer.daemon = True
+                timer.start()
+            
+            response = json.dumps({'provider_reference': provider_reference, 'status': 'accepted'}).encode('utf-8')
+            self.send_response(202)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', port), ProviderHandler)
+    print(f"✅ Payment simulator listening on http://127.0.0.1:{port}")
+    server.serve_forever()
 
 
 
@@ -1097,8 +3814,15 @@ def payment_callback():
 @login_required
 @role_required(['admin'])
 def admin_users():
-    all_users = User.query.all()
-    return render_template('admin_users.html', users=all_users)
+    try:
+        page, next_cursor = keyset_page(User.query, User.created_at, User.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if wants_json():
+        return page_json(page, next_cursor, exclude=('password_hash',))
+    
+    return render_template('admin_users.html', users=page, next_cursor=next_cursor)
 
 
 @app.route('/admin/user/<int:user_id>/toggle-status', methods=['POST'])
@@ -1108,6 +3832,7 @@ def toggle_user_status(user_id):
     user = User.query.get_or_404(user_id)
     user.is_active = not user.is_active
     db.session.commit()
+    user_cache.invalidate(user.id)
     
     return jsonify({'success': True, 'is_active': user.is_active})
 
@@ -1116,21 +3841,20 @@ def toggle_user_status(user_id):
 @login_required
 @role_required(['admin'])
 def admin_statistics():
-    total_revenue = db.session.query(db.func.sum(Sale.total_amount)).scalar() or 0
-    total_expenses = db.session.query(db.func.sum(Expense.amount)).scalar() or 0
-    
     # Monthly growth
-    current_month = datetime.utcnow().replace(day=1)
+    current_month = datetime.utcnow().date().replace(day=1)
     last_month = (current_month - timedelta(days=1)).replace(day=1)
     
-    current_month_sales = db.session.query(db.func.sum(Sale.total_amount)).filter(
-        Sale.created_at >= current_month
-    ).scalar() or 0
-    
-    last_month_sales = db.session.query(db.func.sum(Sale.total_amount)).filter(
-        Sale.created_at >= last_month,
-        Sale.created_at < current_month
-    ).scalar() or 0
+    metrics = read_metrics(
+        ('revenue', 'all'),
+        ('expenses', 'all'),
+        ('revenue', current_month.strftime('%Y-%m')),
+        ('revenue', last_month.strftime('%Y-%m'))
+    )
+    total_revenue = metrics[('revenue', 'all')]
+    total_expenses = metrics[('expenses', 'all')]
+    current_month_sales = metrics[('revenue', current_month.strftime('%Y-%m'))]
+    last_month_sales = metrics[('revenue', last_month.strftime('%Y-%m'))]
     
     growth_rate = ((current_month_sales - last_month_sales) / last_month_sales * 100) if last_month_sales > 0 else 0
     
@@ -1156,66 +3880,1133 @@ def internal_error(error):
 
 
 
+# PART 17B: BACKGROUND JOBS
+
+
+SCHEDULED_JOBS = (
+    ('low_stock_scan', 24 * 3600),
+    ('expiry_scan', 24 * 3600),
+    ('compact_rollups', 24 * 3600),
+    ('cleanup_jobs', 24 * 3600),
+    ('expire_payments', 60),
+)
+SCHEDULE_CHECK_INTERVAL = 30  # seconds
+
+job_workers_pid = None
+job_workers_lock = threading.Lock()
+job_workers_stop = threading.Event()
+
+
+@job_task('expire_payments')
+def expire_payments_job():
+    return {'expired': expire_stale_payments(), 'voided_sales': void_abandoned_sales()}
+
+
+@job_task('compact_rollups')
+def compact_rollups():
+    """Drop empty rollup rows and repair any drift in the platform metrics ledger"""
+    removed = ProductDailySales.query.filter(
+        ProductDailySales.units_sold == 0, ProductDailySales.revenue == 0
+    ).delete(synchronize_session=False)
+    removed += ShopDailySales.query.filter(
+        ShopDailySales.sale_count == 0, ShopDailySales.revenue == 0
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return {'removed_rows': removed, 'repaired_metrics': len(reconcile_metrics(repair=True))}
+
+
+@job_task('cleanup_jobs')
+def cleanup_jobs():
+    """Delete finished jobs past JOB_RETENTION_DAYS together with their report files"""
+    old_jobs = Job.query.filter(Job.finished_at < datetime.utcnow() - timedelta(days=app.config['JOB_RETENTION_DAYS']))
+    
+    removed_files = 0
+    for job in old_jobs.filter(Job.name == 'generate_report', Job.status == 'succeeded'):
+        path = os.path.join(report_folder(), json.loads(job.result)['file'])
+        if os.path.exists(path):
+            os.remove(path)
+            removed_files += 1
+    
+    removed_jobs = old_jobs.delete(synchronize_session=False)
+    db.session.commit()
+    return {'removed_jobs': removed_jobs, 'removed_files': removed_files}
+
+
+def schedule_due_jobs():
+    """Queue each periodic job once per interval; the unique key makes this safe from every worker"""
+    now = time.time()
+    for name, interval in SCHEDULED_JOBS:
+        bucket = int(now // interval)
+        enqueue_unique_job(name, f'{name}:{bucket}', run_at=datetime.utcfromtimestamp(bucket * interval))
+    db.session.commit()
+
+
+def requeue_stale_jobs():
+    """Recover jobs whose worker died mid-run, failing those that used up their attempts"""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT'])
+    stale = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff)
+    stale.filter(Job.attempts >= Job.max_attempts).update({
+        'status': 'failed', 'error': 'Worker stopped while running the job', 'finished_at': datetime.utcnow()
+    }, synchronize_session=False)
+    stale.update({'status': 'queued', 'locked_by': None}, synchronize_session=False)
+    db.session.commit()
+
+
+def claim_job(worker_id):
+    """Atomically take the next due job; a conditional UPDATE stops two workers taking the same one"""
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(
+        Job.status == 'queued', Job.run_at <= now
+    ).order_by(Job.run_at, Job.id).limit(5)
+    if db.engine.dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+    
+    for (job_id,) in candidates.all():
+        claimed = Job.query.filter(Job.id == job_id, Job.status == 'queued').update({
+            'status': 'running', 'locked_by': worker_id, 'locked_at': now, 'attempts': Job.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def job_heartbeat(engine, job_id, worker_id, stop_event):
+    """Renew a running job's lock until stop_event is set, so long jobs are not requeued as dead"""
+    table = Job.__table__
+    while not stop_event.wait(app.config['JOB_LOCK_TIMEOUT'] / 4):
+        try:
+            with engine.begin() as connection:
+                connection.execute(table.update().where(
+                    table.c.id == job_id, table.c.status == 'running', table.c.locked_by == worker_id
+                ).values(locked_at=datetime.utcnow()))
+        except Exception as e:
+            print(f"❌ Job {job_id} heartbeat: {e}")
+
+
+def run_job(job):
+    """Execute a claimed job, then record its result or schedule a retry with exponential backoff"""
+    spec = JOB_TASKS.get(job.name)
+    payload = json.loads(job.payload or '{}')
+    job_id = job.id
+    
+    stop_heartbeat = threading.Event()
+    threading.Thread(
+        target=job_heartbeat, args=(db.engine, job_id, job.locked_by, stop_heartbeat), daemon=True
+    ).start()
+    try:
+        if spec is None:
+            raise PermanentJobError(f'Unknown job {job.name}')
+        result = spec['fn'](**payload)
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        retry = not isinstance(e, PermanentJobError) and job.attempts < job.max_attempts
+        job.error = f'{type(e).__name__}: {e}'[:1000]
+        job.locked_by = None
+        if retry:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(
+                seconds=app.config[spec['backoff_config']] * 2 ** (job.attempts - 1)
+            )
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        
+        if not retry and spec and spec['on_failure']:
+            spec['on_failure'](e, **payload)
+        return
+    finally:
+        stop_heartbeat.set()
+    
+    job = db.session.get(Job, job_id)
+    job.status = 'succeeded'
+    job.result = json.dumps(result, default=str) if result is not None else None
+    job.error = None
+    job.locked_by = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def job_worker_loop(worker_id, stop_event, schedule=False):
+    next_schedule = 0
+    while not stop_event.is_set():
+        ran = False
+        with app.app_context():
+            try:
+                if schedule and time.monotonic() >= next_schedule:
+                    schedule_due_jobs()
+                    requeue_stale_jobs()
+                    next_schedule = time.monotonic() + SCHEDULE_CHECK_INTERVAL
+                job = claim_job(worker_id)
+                if job is not None:
+                    run_job(job)
+                    ran = True
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Job worker {worker_id}: {e}")
+        if not ran:
+            stop_event.wait(app.config['JOB_POLL_INTERVAL'])
+
+
+def start_job_threads(count, stop_event):
+    threads = []
+    for index in range(count):
+        thread = threading.Thread(
+            target=job_worker_loop,
+            args=(f'{platform.node()}:{os.getpid()}:{index}', stop_event, index == 0),
+            name=f'job-worker-{index}',
+            daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def start_job_workers():
+    """Start JOB_WORKERS in-process job threads once per process; 0 leaves jobs to `flask worker`"""
+    global job_workers_pid
+    with job_workers_lock:
+        # Threads do not survive fork, so a pre-forked worker starts its own
+        if job_workers_pid == os.getpid() or app.config['JOB_WORKERS'] <= 0:
+            return
+        job_workers_pid = os.getpid()
+    start_job_threads(app.config['JOB_WORKERS'], job_workers_stop)
+
+
+def job_json(job):
+    data = {
+        'job_id': job.id,
+        'name': job.name,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'run_at': job.run_at.isoformat() if job.run_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+    if job.name == 'generate_report' and job.status == 'succeeded':
+        data['download_url'] = url_for('job_download', job_id=job.id)
+    return data
+
+
+def find_user_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or (job.user_id != current_user.id and current_user.role != 'admin'):
+        return None
+    return job
+
+
+@app.route('/api/jobs')
+@login_required
+@role_required(['admin'])
+def jobs():
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter(Job.status == request.args['status'])
+    try:
+        page, next_cursor = keyset_page(query, Job.created_at, Job.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_json(page, next_cursor, exclude=('payload', 'result'))
+
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = find_user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_json(job))
+
+
+@app.route('/api/jobs/<int:job_id>/download')
+@login_required
+def job_download(job_id):
+    job = find_user_job(job_id)
+    if job is None or job.name != 'generate_report' or job.status != 'succeeded':
+        return jsonify({'error': 'Report not ready'}), 404
+    
+    result = json.loads(job.result)
+    return send_file(
+        os.path.join(report_folder(), result['file']),
+        mimetype=result['mimetype'],
+        as_attachment=True,
+        download_name=result['filename']
+    )
+
+
+@app.cli.command('worker')
+@click.option('--threads', default=4, help='Jobs run concurrently by this process')
+def worker_command(threads):
+    """Run queued and scheduled background jobs until interrupted"""
+    global job_workers_pid
+    job_workers_pid = os.getpid()  # jobs enqueued here must not start extra in-process threads
+    
+    stop_event = threading.Event()
+    workers = start_job_threads(threads, stop_event)
+    print(f"✅ Job worker running with {threads} threads")
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+
 # PART 18: DATABASE INITIALIZATION
 
 def init_db():
-    """Initialize database with tables and default data"""
+    """Create missing tables and the default admin user; never drops existing data"""
+    print("🔧 Creating database tables...")
+    db.create_all()
+    with db.engine.begin() as connection:
+        ensure_product_search_index(connection)
+    print("✅ Database tables created successfully!")
+    
+    if User.query.filter_by(phone='admin').first():
+        print("ℹ️ Admin user already exists")
+        return
+    
+    admin = User(
+        phone='admin',
+        name='Administrator',
+        email='admin@vendorapp.com',
+        role='admin'
+    )
+    admin.set_password(os.environ.get('ADMIN_PASSWORD', 'admin123'))
+    db.session.add(admin)
+    bump_metrics({'users': 1})
+    db.session.commit()
+    print("✅ Default admin user created (phone: admin)")
+
+
+# Flask-SQLAlchemy builds the engine and the job workers start when the module is imported,
+# so these cannot change afterwards
+IMPORT_TIME_CONFIG_KEYS = ('SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_ENGINE_OPTIONS', 'SQLALCHEMY_BINDS',
+                           'SQLALCHEMY_ECHO', 'SQLALCHEMY_RECORD_QUERIES', 'JOB_WORKERS')
+
+
+def configure_app(config=None):
+    """Apply extra config to the module's single application, start its job workers and return it
+    
+    Select the database and worker count through DATABASE_URL / DB_POOL_* / JOB_WORKERS
+    before import; those settings passed here are rejected.
+    """
+    import_keys = sorted(set(config or ()) & set(IMPORT_TIME_CONFIG_KEYS))
+    if import_keys:
+        raise ValueError(f"{', '.join(import_keys)} must be set through the environment before import")
+    if config:
+        app.config.update(config)
+    start_job_workers()
+    return app
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the schema and default admin user on a new database"""
     with app.app_context():
-        try:
-            # First, create all tables - this must happen before any queries
-            print("🔧 Creating database tables...")
-            db.create_all()
-            print("✅ Database tables created successfully!")
+        init_db()
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Rebuild the daily sales rollups and product sales counters from existing sales"""
+    with app.app_context():
+        count = rebuild_daily_sales()
+        product_count = rebuild_product_sales()
+    print(f"✅ Rebuilt {count} daily sales rows")
+    print(f"✅ Rebuilt {product_count} product daily sales rows")
+
+
+
+def migrate_db():
+    """Bring an existing database up to date with the models without dropping data"""
+    db.create_all()
+    applied = []
+    
+    with db.engine.begin() as connection:
+        inspector = db.inspect(connection)
+        
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if column.unique:
+                    connection.execute(db.text(
+                        f'CREATE UNIQUE INDEX uq_{table.name}_{column.name} ON {table.name} ({column.name})'
+                    ))
+                applied.append(f'column {table.name}.{column.name}')
             
-            # Now that tables exist, we can safely query them
-            # Check if admin user exists
-            admin = User.query.filter_by(phone='admin').first()
-            if not admin:
-                admin = User(
-                    phone='admin',
-                    name='Administrator',
-                    email='admin@vendorapp.com',
-                    role='admin'
-                )
-                admin.set_password('admin123')
-                db.session.add(admin)
-                db.session.commit()
-                print("✅ Default admin user created (phone: admin, password: admin123)")
+            if connection.dialect.name == 'sqlite':
+                # The SQLite inspector skips expression indexes such as ix_products_shop_name_lower
+                existing_indexes = set(connection.execute(db.text(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+                ), {'table': table.name}).scalars())
             else:
-                print("ℹ️ Admin user already exists")
-                
-        except Exception as e:
-            print(f"❌ Error in database initialization: {e}")
-            # If there's an error, the database might be corrupted
-            # Delete the database file and try again
-            import os
-            if os.path.exists('vendor_app.db'):
-                os.remove('vendor_app.db')
-                print("🗑️ Removed corrupted database file")
+                existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    applied.append(f'index {index.name}')
+        
+        if ensure_product_search_index(connection):
+            applied.append('index products full-text search')
+        if ensure_metric_shards(connection):
+            applied.append('sharded platform_metrics')
+        
+        # Per-vendor change counters start at the old single counter's value, so issued cursors stay valid
+        counters = SyncVersion.__table__
+        start = connection.execute(db.select(db.func.coalesce(db.func.max(counters.c.value), 0))).scalar()
+        added = connection.execute(counters.insert().from_select(['id', 'value'], db.select(
+            Shop.owner_id, db.literal(start)
+        ).where(~db.exists().where(counters.c.id == Shop.owner_id)).distinct())).rowcount
+        if added:
+            applied.append(f'{added} vendor change counters')
+    
+    return applied
+
+
+def hot_queries():
+    """Main queries of the hot routes, built by the same functions the routes call, to verify index usage"""
+    vendor = User(id=1, role='vendor')
+    cursor = encode_cursor(datetime(2024, 1, 1), 1)
+    day_cursor = encode_cursor(datetime(2024, 1, 1).date(), 1)
+    start, end = datetime(2024, 1, 1), datetime(2024, 2, 1)
+    return {
+        'vendor shops': vendor_shops_query(vendor.id),
+        'dashboard recent sales': recent_sales_query([1, 2], 10),
+        'dashboard alerts': recent_alerts_query(vendor.id),
+        'unread alert count': unread_alerts_query(vendor.id),
+        'shop products': shop_products_query(1),
+        'shop recent sales': recent_sales_query([1], 20),
+        'products list': keyset_query(product_list_query(vendor), Product.created_at, Product.id),
+        'products list, next page': keyset_query(product_list_query(vendor), Product.created_at, Product.id, cursor),
+        'sales list': keyset_query(sale_list_query(vendor), Sale.created_at, Sale.id),
+        'sales list, next page': keyset_query(sale_list_query(vendor), Sale.created_at, Sale.id, cursor),
+        'expenses list': keyset_query(expense_list_query(vendor), Expense.date, Expense.id),
+        'expenses list, next page': keyset_query(expense_list_query(vendor), Expense.date, Expense.id, day_cursor),
+        'orders list': keyset_query(order_list_query(vendor), Order.created_at, Order.id),
+        'alerts list': keyset_query(alert_list_query(vendor), Alert.created_at, Alert.id),
+        'alerts list, next page': keyset_query(alert_list_query(vendor), Alert.created_at, Alert.id, cursor),
+        'sale items': sale_items_query(1),
+        'daily sales trend': sales_trend_query(vendor, start, end, 'day'),
+        'hourly sales trend': sales_trend_query(vendor, start, end, 'hour'),
+        'low stock scan': missing_low_stock_alerts_query(vendor.id)
+    }
+
+
+def check_query_plans():
+    """EXPLAIN each hot query; reports (name, avoids a full table scan, sorts before its limit, plan)"""
+    dialect = db.engine.dialect
+    report = []
+    
+    with db.engine.connect() as connection:
+        if dialect.name == 'postgresql':
+            # Tiny tables would otherwise always be sequentially scanned
+            connection.execute(db.text('SET enable_seqscan = off'))
+        
+        for name, query in hot_queries().items():
+            sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+            if dialect.name == 'sqlite':
+                plan = [row[-1] for row in connection.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+                full_scan = any(step.startswith('SCAN') and 'INDEX' not in step for step in plan)
+                sorts = any('TEMP B-TREE FOR ORDER BY' in step for step in plan)
+            else:
+                plan = [row[0] for row in connection.execute(db.text(f'EXPLAIN {sql}'))]
+                full_scan = any('Seq Scan' in step for step in plan)
+                sorts = any(step.strip(' ->').startswith('Sort') for step in plan)
+            report.append((name, not full_scan, sorts, plan))
+    
+    return report
+
+
+@app.cli.command('reconcile-metrics')
+@click.option('--dry-run', is_flag=True, help='Report drift without repairing it')
+def reconcile_metrics_command(dry_run):
+    """Detect and repair drift between the platform metrics ledger and the source tables"""
+    with app.app_context():
+        drift = reconcile_metrics(repair=not dry_run)
+    for entry in drift:
+        print(f"⚠️ {entry['name']} [{entry['period']}]: ledger {entry['actual']} != actual {entry['expected']}")
+    print(f"✅ {len(drift)} drifted metrics {'found' if dry_run else 'repaired'}")
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Add missing tables, columns and indexes to an existing database"""
+    with app.app_context():
+        applied = migrate_db()
+    for change in applied:
+        print(f"✅ Added {change}")
+    print(f"✅ Database up to date ({len(applied)} changes)")
+
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """Fail if any hot query falls back to a full table scan; flag those that sort every match"""
+    with app.app_context():
+        report = check_query_plans()
+    
+    failures = 0
+    for name, uses_index, sorts, plan in report:
+        mark = '❌' if not uses_index else '⚠️' if sorts else '✅'
+        print(f"{mark} {name}: {' | '.join(plan)}")
+        failures += not uses_index
+    
+    if any(sorts for _, _, sorts, _ in report):
+        print("⚠️ Sorted queries read every matching row before the LIMIT (e.g. a multi-shop vendor's sales)")
+    if failures:
+        raise SystemExit(1)
+
+
+def process_pool_context():
+    """Fork where the platform supports it (fast, shares the loaded app), otherwise spawn"""
+    import multiprocessing
+    
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def generate_ids_threaded(count, threads):
+    """Mint count ids per thread from the shared generator; used by the check-ids stress run"""
+    results = [[] for _ in range(threads)]
+    
+    def worker(bucket):
+        bucket.extend(id_generator.next_id() for _ in range(count))
+    
+    workers = [threading.Thread(target=worker, args=(bucket,)) for bucket in results]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results
+
+
+@app.cli.command('check-ids')
+@click.option('--count', default=100000, help='Ids per thread')
+@click.option('--threads', default=4, help='Threads per process')
+@click.option('--processes', default=4, help='Worker processes')
+def check_ids_command(count, threads, processes):
+    """Stress the id generator across threads and processes and fail on any collision"""
+    from concurrent.futures import ProcessPoolExecutor
+    
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=process_pool_context()) as pool:
+        batches = list(pool.map(generate_ids_threaded, [count] * processes, [threads] * processes))
+    elapsed = time.perf_counter() - started
+    
+    seen = set()
+    total = 0
+    unordered = 0
+    for process_batches in batches:
+        for ids in process_batches:
+            total += len(ids)
+            seen.update(ids)
+            unordered += sum(1 for a, b in zip(ids, ids[1:]) if a >= b)
+    
+    collisions = total - len(seen)
+    print(f"{'✅' if not collisions and not unordered else '❌'} {total} ids in {elapsed:.2f}s, "
+          f"{collisions} collisions, {unordered} out-of-order within a thread")
+    if collisions or unordered:
+        raise SystemExit(1)
+
+
+# PART 18B: BENCHMARKS AND LOAD CHECKS
+# These commands seed throwaway "bench-" vendors, so point DATABASE_URL at a scratch database first
+
+
+def create_bench_vendor(shop_count=1):
+    """Create a vendor with shop_count shops; returns (user_id, shop_ids)"""
+    suffix = id_generator.next_id()[-10:]
+    user = User(phone=f'bench-{suffix}', name='Benchmark', role='vendor')
+    user.set_password(secrets.token_hex(16))
+    db.session.add(user)
+    db.session.flush()
+    
+    shops = [Shop(name=f'Bench {suffix} #{i}', category='bench', owner_id=user.id) for i in range(shop_count)]
+    db.session.add_all(shops)
+    bump_metrics({'users': 1, 'shops': shop_count})
+    db.session.commit()
+    return user.id, [shop.id for shop in shops]
+
+
+def create_bench_products(shop_id, count, quantity, price=1.0):
+    """Add count products with the given stock to a bench shop; returns their ids"""
+    products = [
+        Product(shop_id=shop_id, name=f'Bench item {i}', price=price, quantity=quantity, reorder_level=0)
+        for i in range(count)
+    ]
+    db.session.add_all(products)
+    bump_metrics({'products': count})
+    db.session.commit()
+    return [product.id for product in products]
+
+
+def bench_client(user_id):
+    """Test client with a logged-in session for user_id, skipping the password hash"""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+
+def post_bench_sales(user_id, shop_id, product_ids, count):
+    """Post count one-unit sales in the calling thread; returns per-status counts and latencies"""
+    client = bench_client(user_id)
+    statuses = {}
+    latencies = []
+    for i in range(count):
+        product_id = product_ids[i % len(product_ids)]
+        started = time.perf_counter()
+        response = client.post('/sale/create', json={
+            'shop_id': shop_id,
+            'total_amount': 1.0,
+            'items': [{'product_id': product_id, 'quantity': 1, 'unit_price': 1.0, 'subtotal': 1.0}]
+        })
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return statuses, latencies
+
+
+def merge_bench_results(results):
+    statuses = {}
+    latencies = []
+    for run_statuses, run_latencies in results:
+        for status, count in run_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+        latencies += run_latencies
+    return statuses, sorted(latencies)
+
+
+def percentile_ms(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)] * 1000
+
+
+def check_stock_conservation(product_ids, initial, sold):
+    """Compare stock and units_sold with the number of successful sales; returns failure messages"""
+    failures = []
+    remaining = db.session.query(db.func.sum(Product.quantity)).filter(Product.id.in_(product_ids)).scalar()
+    units_sold = db.session.query(db.func.coalesce(db.func.sum(ProductDailySales.units_sold), 0)).filter(
+        ProductDailySales.product_id.in_(product_ids)
+    ).scalar()
+    
+    if remaining != initial - sold:
+        failures.append(f'stock is {remaining}, expected {initial - sold}')
+    if remaining < 0:
+        failures.append(f'stock oversold to {remaining}')
+    if units_sold != sold:
+        failures.append(f'units_sold is {units_sold}, expected {sold}')
+    return failures
+
+
+def seed_bench_sales(shop_id, product_ids, count):
+    """Book count one-unit sales spread over recent days, keeping the rollups in step"""
+    now = datetime.utcnow()
+    for i in range(count):
+        sold_at = now - timedelta(hours=7 * i)
+        db.session.add(Sale(
+            sale_number=generate_number('SALE'),
+            shop_id=shop_id,
+            total_amount=1.0,
+            created_at=sold_at,
+            items=[SaleItem(product_id=product_ids[i % len(product_ids)], quantity=1, unit_price=1.0, subtotal=1.0)]
+        ))
+        record_daily_sale(shop_id, sold_at, 1.0, 1)
+    db.session.commit()
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements sent by the engine while the block runs"""
+    counter = {'queries': 0}
+    
+    def before_cursor_execute(*args):
+        counter['queries'] += 1
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@app.cli.command('bench-dashboard')
+@click.option('--shops', default='1,10,50,100', help='Comma-separated shop counts to measure')
+@click.option('--products', default=20, help='Products per shop')
+@click.option('--sales', default=50, help='Sales per shop')
+@click.option('--repeat', default=20, help='Timed page loads per shop count')
+def bench_dashboard_command(shops, products, sales, repeat):
+    """Show vendor dashboard query count and latency as the shop count grows"""
+    stats_queries = set()
+    for shop_count in [int(count) for count in shops.split(',')]:
+        with app.app_context():
+            user_id, shop_ids = create_bench_vendor(shop_count)
+            for shop_id in shop_ids:
+                seed_bench_sales(shop_id, create_bench_products(shop_id, products, 100), sales)
             
-            # Try to recreate everything
-            try:
-                db.create_all()
-                print("✅ Database tables recreated")
-                
-                # Create admin user
-                admin = User(
-                    phone='admin',
-                    name='Administrator',
-                    email='admin@vendorapp.com',
-                    role='admin'
-                )
-                admin.set_password('admin123')
-                db.session.add(admin)
-                db.session.commit()
-                print("✅ Default admin user created after recovery")
-            except Exception as e2:
-                print(f"❌ Critical error: Could not initialize database: {e2}")
-                raise e2
+            with count_queries() as counter:
+                vendor_dashboard_stats(shop_ids)
+            stats_queries.add(counter['queries'])
+        
+        client = bench_client(user_id)
+        client.get('/dashboard')  # warm the user cache and templates
+        timings = []
+        with app.app_context():
+            for _ in range(repeat):
+                with count_queries() as page_counter:
+                    started = time.perf_counter()
+                    response = client.get('/dashboard')
+                    timings.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise click.ClickException(f'/dashboard returned {response.status_code}')
+        
+        timings.sort()
+        print(f"{shop_count:>5} shops: stats {counter['queries']} queries, page {page_counter['queries']} queries, "
+              f"p50 {percentile_ms(timings, 0.5):.1f} ms, p99 {percentile_ms(timings, 0.99):.1f} ms")
+    
+    if len(stats_queries) > 1:
+        print(f"❌ Stats query count varies with shop count: {sorted(stats_queries)}")
+        raise SystemExit(1)
+
+
+def open_socket_client(ws_url, cookie):
+    """Open a raw Engine.IO websocket and join the default Socket.IO namespace"""
+    import simple_websocket
+    
+    ws = simple_websocket.Client.connect(ws_url, headers={'Cookie': cookie})
+    packet = ws.receive(timeout=10)
+    if not packet or not packet.startswith('0'):
+        ws.close()
+        raise ConnectionError(f'Unexpected handshake {packet!r}')
+    
+    ws.send('40')
+    while True:
+        packet = ws.receive(timeout=10)
+        if packet == '2':
+            ws.send('3')
+        elif packet and packet.startswith('40'):
+            return ws
+        else:
+            ws.close()
+            raise ConnectionError(f'Namespace refused: {packet!r}')
+
+
+def drain_socket_clients(clients, event_prefix=None):
+    """Answer pings on every client; returns (clients that saw event_prefix, clients that dropped)"""
+    import simple_websocket
+    
+    seen = set()
+    dropped = set()
+    for index, ws in enumerate(clients):
+        try:
+            while (packet := ws.receive(timeout=0)) is not None:
+                if packet == '2':
+                    ws.send('3')
+                elif event_prefix and packet.startswith(event_prefix):
+                    seen.add(index)
+        except simple_websocket.ConnectionClosed:
+            dropped.add(index)
+    return seen, dropped
+
+
+def process_rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+@app.cli.command('bench-socketio')
+@click.option('--url', default='http://127.0.0.1:5000', help='Running server to connect to')
+@click.option('--clients', default=500, help='Idle Socket.IO connections to open')
+@click.option('--hold', default=30, help='Seconds to hold the connections idle')
+@click.option('--poll-interval', default=30, help='Seconds between /api/check-alerts polls being replaced')
+@click.option('--server-pid', type=int, help='Server process to sample memory from (Linux)')
+def bench_socketio_command(url, clients, hold, poll_interval, server_pid):
+    """Hold idle Socket.IO clients on one worker and compare with the polling load they replace"""
+    import http.cookiejar
+    import urllib.parse
+    
+    password = secrets.token_hex(8)
+    with app.app_context():
+        user_id, (shop_id,) = create_bench_vendor()
+        user = db.session.get(User, user_id)
+        user.set_password(password)
+        phone = user.phone
+        product_id = create_bench_products(shop_id, 1, 1000000)[0]
+        db.session.commit()
+    
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    opener.open(f'{url}/login', data=urllib.parse.urlencode({'phone': phone, 'password': password}).encode())
+    cookie = '; '.join(f'{c.name}={c.value}' for c in jar)
+    
+    poll_times = []
+    for _ in range(20):
+        started = time.perf_counter()
+        opener.open(f'{url}/api/check-alerts').read()
+        poll_times.append(time.perf_counter() - started)
+    poll_times.sort()
+    
+    rss_before = process_rss_mb(server_pid) if server_pid else None
+    ws_url = url.replace('http', 'ws', 1).rstrip('/') + '/socket.io/?EIO=4&transport=websocket'
+    sockets = []
+    failed = 0
+    last_error = None
+    started = time.perf_counter()
+    for _ in range(clients):
+        try:
+            sockets.append(open_socket_client(ws_url, cookie))
+        except (OSError, ConnectionError) as e:
+            failed += 1
+            last_error = e
+    connect_time = time.perf_counter() - started
+    print(f"Connected {len(sockets)}/{clients} clients in {connect_time:.1f}s" +
+          (f" (last error: {last_error})" if failed else ''))
+    
+    dropped = set()
+    deadline = time.monotonic() + hold
+    while time.monotonic() < deadline:
+        dropped |= drain_socket_clients(sockets)[1]
+        time.sleep(1)
+    rss_after = process_rss_mb(server_pid) if server_pid else None
+    
+    # One sale fans a new_sale event out to every client in the shop room
+    started = time.perf_counter()
+    opener.open(urllib.request.Request(f'{url}/sale/create', data=json.dumps({
+        'shop_id': shop_id,
+        'total_amount': 1.0,
+        'items': [{'product_id': product_id, 'quantity': 1, 'unit_price': 1.0, 'subtotal': 1.0}]
+    }).encode(), headers={'Content-Type': 'application/json'}))
+    delivered = set()
+    while len(delivered) < len(sockets) - len(dropped) and time.perf_counter() - started < 30:
+        seen, lost = drain_socket_clients(sockets, '42["new_sale"')
+        delivered |= seen
+        dropped |= lost
+        time.sleep(0.01)
+    fanout_time = time.perf_counter() - started
+    
+    for ws in sockets:
+        ws.close()
+    
+    held = len(sockets) - len(dropped)
+    print(f"{'✅' if held == clients else '❌'} Held {held} idle clients for {hold}s ({len(dropped)} dropped)")
+    print(f"new_sale reached {len(delivered)} clients in {fanout_time * 1000:.0f} ms")
+    if rss_before is not None and rss_after is not None:
+        print(f"Server memory {rss_before:.0f} MB -> {rss_after:.0f} MB "
+              f"({(rss_after - rss_before) * 1024 / max(held, 1):.0f} KB per connection)")
+    print(f"Replaces {clients / poll_interval:.1f} req/s of /api/check-alerts polling at one poll per "
+          f"{poll_interval}s (p50 {percentile_ms(poll_times, 0.5):.1f} ms each, about "
+          f"{clients / poll_interval * percentile_ms(poll_times, 0.5) / 1000:.2f} worker-seconds per second)")
+    if held < clients:
+        raise SystemExit(1)
+
+
+def post_bench_sales_process(user_id, shop_id, product_ids, count):
+    """One bench-workers process: post sales over its own pool, not connections inherited by fork"""
+    with app.app_context():
+        db.engine.dispose(close=False)
+    return post_bench_sales(user_id, shop_id, product_ids, count)
+
+
+@app.cli.command('bench-workers')
+@click.option('--processes', default=4, help='Worker processes sharing the database')
+@click.option('--sales', default=200, help='Sales posted by each process')
+@click.option('--products', default=10, help='Products the sales are spread over')
+def bench_workers_command(processes, sales, products):
+    """Load the configured database from several worker processes and verify stock stays exact"""
+    from concurrent.futures import ProcessPoolExecutor
+    
+    stock = processes * sales
+    with app.app_context():
+        user_id, (shop_id,) = create_bench_vendor()
+        product_ids = create_bench_products(shop_id, products, stock)
+        engine = f"{db.engine.dialect.name}, pool {type(db.engine.pool).__name__}"
+        db.engine.dispose()
+    
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=process_pool_context()) as pool:
+        results = list(pool.map(post_bench_sales_process, [user_id] * processes, [shop_id] * processes,
+                                [product_ids] * processes, [sales] * processes))
+    elapsed = time.perf_counter() - started
+    
+    statuses, latencies = merge_bench_results(results)
+    sold = statuses.get(200, 0)
+    with app.app_context():
+        failures = check_stock_conservation(product_ids, stock * products, sold)
+    if sold != processes * sales:
+        failures.append(f'{processes * sales - sold} sales failed')
+    
+    print(f"{'❌' if failures else '✅'} {processes * sales} sales from {processes} processes ({engine}) "
+          f"in {elapsed:.2f}s ({processes * sales / elapsed:.0f}/s, p50 {percentile_ms(latencies, 0.5):.1f} ms, "
+          f"p99 {percentile_ms(latencies, 0.99):.1f} ms); responses {dict(sorted(statuses.items()))}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+BENCH_WORDS = ('sukari', 'unga', 'mchele', 'maziwa', 'mafuta', 'chumvi', 'sabuni', 'chai',
+               'kahawa', 'maharage', 'soda', 'juisi', 'biskuti', 'mkate', 'nyanya', 'vitunguu')
+
+
+def time_calls(fn, args_list):
+    """Run fn over args_list and return the sorted per-call latencies in seconds"""
+    timings = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)
+
+
+@app.cli.command('bench-search')
+@click.option('--products', default=100000, help='Catalog size to import into the bench shop')
+@click.option('--lookups', default=1000, help='Timed calls per query type')
+@click.option('--budget-ms', default=10.0, help='Fail if barcode/SKU lookup p99 exceeds this')
+def bench_search_command(products, lookups, budget_ms):
+    """Import a large catalog through the bulk importer and time code, prefix and full-text search"""
+    import random
+    
+    with app.app_context():
+        user_id, (shop_id,) = create_bench_vendor()
+        tag = id_generator.next_id()[-8:]
+        
+        def rows():
+            for i in range(products):
+                yield {
+                    'sku': f'B{tag}-{i}',
+                    'barcode': f'{tag}{i:09d}',
+                    'name': f'{BENCH_WORDS[i % len(BENCH_WORDS)].title()} '
+                            f'{BENCH_WORDS[(i // len(BENCH_WORDS)) % len(BENCH_WORDS)]} {i}',
+                    'category': BENCH_WORDS[(i * 7) % len(BENCH_WORDS)],
+                    'price': 1000 + i % 500,
+                    'quantity': 50,
+                    'reorder_level': 0
+                }
+        
+        started = time.perf_counter()
+        report = import_products(shop_id, user_id, rows())
+        print(f"Imported {report['created']} products in {time.perf_counter() - started:.1f}s")
+        
+        picks = [random.randrange(products) for _ in range(lookups)]
+        cases = [
+            ('barcode', find_products_by_code, [(shop_id, f'{tag}{i:09d}') for i in picks]),
+            ('sku', find_products_by_code, [(shop_id, f'B{tag}-{i}') for i in picks]),
+            ('name prefix', search_products, [(shop_id, random.choice(BENCH_WORDS)[:3]) for _ in picks]),
+            ('full text', search_products, [(shop_id, ' '.join(random.sample(BENCH_WORDS, 2))) for _ in picks]),
+        ]
+        
+        over_budget = []
+        for name, fn, args_list in cases:
+            timings = time_calls(fn, args_list)
+            p99 = percentile_ms(timings, 0.99)
+            print(f"{name:>12}: p50 {percentile_ms(timings, 0.5):.2f} ms, p99 {p99:.2f} ms")
+            if fn is find_products_by_code and p99 > budget_ms:
+                over_budget.append(name)
+    
+    if over_budget:
+        print(f"❌ {', '.join(over_budget)} p99 over the {budget_ms} ms budget")
+        raise SystemExit(1)
+
+
+@app.cli.command('bench-alerts')
+@click.option('--products', default='100,1000,10000', help='Comma-separated catalog sizes to measure')
+@click.option('--low-share', default=0.1, help='Fraction of each catalog that is below its reorder level')
+@click.option('--repeat', default=50, help='Timed steady-state scans per catalog size')
+@click.option('--budget-ms', default=20.0, help='Fail if the steady-state scan p99 exceeds this')
+def bench_alerts_command(products, low_share, repeat, budget_ms):
+    """Time the low-stock scan behind /api/check-alerts as the catalog grows"""
+    over_budget = []
+    for count in [int(size) for size in products.split(',')]:
+        with app.app_context():
+            user_id, (shop_id,) = create_bench_vendor()
+            low = int(count * low_share)
+            create_bench_products(shop_id, low, 0)
+            create_bench_products(shop_id, count - low, 100)
+            
+            # The first scan raises one alert per low product; later polls should find nothing new
+            created = len(create_low_stock_alerts(user_id))
+            db.session.commit()
+            
+            timings = []
+            for _ in range(repeat):
+                with count_queries() as counter:
+                    started = time.perf_counter()
+                    repeated = create_low_stock_alerts(user_id)
+                    timings.append(time.perf_counter() - started)
+                db.session.rollback()
+                if repeated:
+                    raise click.ClickException(f'{len(repeated)} duplicate alerts on a repeated scan')
+            
+            uses_index = None
+            if db.engine.dialect.name == 'sqlite':
+                sql = str(missing_low_stock_alerts_query(user_id).statement.compile(
+                    dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}
+                ))
+                plan = [row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+                uses_index = any('ix_alerts_product_user_unread' in step for step in plan)
+        
+        timings.sort()
+        p99 = percentile_ms(timings, 0.99)
+        print(f"{count:>6} products: {created} alerts raised, steady scan {counter['queries']} queries, "
+              f"p50 {percentile_ms(timings, 0.5):.1f} ms, p99 {p99:.1f} ms"
+              + ('' if uses_index is None else f", anti-join {'uses' if uses_index else 'MISSES'} ix_alerts_product_user_unread"))
+        if p99 > budget_ms or uses_index is False:
+            over_budget.append(count)
+    
+    if over_budget:
+        print(f"❌ Scan over the {budget_ms} ms budget or off the alert index at {over_budget} products")
+        raise SystemExit(1)
+
+
+@app.cli.command('bench-sync')
+@click.option('--records', default=5000, help='Offline sales to upload in total')
+@click.option('--batch-size', default=500, help='Records per /api/sync/batch request')
+@click.option('--products', default=50, help='Products the sales are spread over')
+def bench_sync_command(records, batch_size, products):
+    """Upload offline sales through /api/sync/batch, then resend them and check nothing is booked twice"""
+    with app.app_context():
+        user_id, (shop_id,) = create_bench_vendor()
+        product_ids = create_bench_products(shop_id, products, records)
+    
+    batches = [[{
+        'client_id': str(uuid.uuid4()),
+        'type': 'sale',
+        'payload': {
+            'shop_id': shop_id,
+            'total_amount': 1.0,
+            'items': [{'product_id': product_ids[i % products], 'quantity': 1, 'unit_price': 1.0, 'subtotal': 1.0}]
+        }
+    } for i in range(start, min(start + batch_size, records))] for start in range(0, records, batch_size)]
+    
+    client = bench_client(user_id)
+    failures = []
+    for label, expected in (('upload', 'created'), ('resend', 'duplicates')):
+        timings = []
+        counted = 0
+        started = time.perf_counter()
+        for batch in batches:
+            batch_started = time.perf_counter()
+            response = client.post('/api/sync/batch', json={'records': batch})
+            timings.append(time.perf_counter() - batch_started)
+            if response.status_code != 200:
+                raise click.ClickException(f'/api/sync/batch returned {response.status_code}')
+            counted += response.json[expected]
+        elapsed = time.perf_counter() - started
+        
+        timings.sort()
+        print(f"{label:>6}: {records} records in {elapsed:.2f}s ({records / elapsed:.0f} records/s), "
+              f"batch p50 {percentile_ms(timings, 0.5):.0f} ms, p99 {percentile_ms(timings, 0.99):.0f} ms, {counted} {expected}")
+        if counted != records:
+            failures.append(f'{label}: {counted} {expected}, expected {records}')
+    
+    with app.app_context():
+        failures += check_stock_conservation(product_ids, records * products, records)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+@app.cli.command('check-cold-start')
+@click.option('--runs', default=5, help='Fresh interpreter imports to time')
+@click.option('--budget-ms', default=1000.0, help='Fail if the median import takes longer than this')
+def check_cold_start_command(runs, budget_ms):
+    """Time a fresh worker's `import app` and fail if it is over budget or touches the database"""
+    import subprocess
+    
+    timings = []
+    module_ms = []
+    with tempfile.TemporaryDirectory() as scratch:
+        database = os.path.join(scratch, 'cold_start.db')
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', JOB_WORKERS='0')
+        env.pop('FLASK_RUN_FROM_CLI', None)
+        for _ in range(runs):
+            started = time.perf_counter()
+            process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                                     cwd=app.root_path, env=env, capture_output=True, text=True)
+            timings.append(time.perf_counter() - started)
+            if process.returncode:
+                raise click.ClickException(f'import app failed:\n{process.stderr[-2000:]}')
+            # -X importtime lines read "import time: self [us] | cumulative | package"
+            for line in process.stderr.splitlines():
+                fields = line.split('|')
+                if len(fields) == 3 and fields[2].strip() == 'app':
+                    module_ms.append(int(fields[0].split(':')[1]) / 1000)
+        touched = os.path.exists(database)
+    
+    timings.sort()
+    median = percentile_ms(timings, 0.5)
+    print(f"{'✅' if median <= budget_ms and not touched else '❌'} import app: median {median:.0f} ms, "
+          f"max {timings[-1] * 1000:.0f} ms over {runs} runs; app module itself {min(module_ms or [0]):.0f} ms")
+    if touched:
+        print("❌ Importing the module opened the database")
+    if median > budget_ms or touched:
+        raise SystemExit(1)
+
+
+@app.cli.command('check-oversell')
+@click.option('--stock', default=100, help='Starting stock of the contested product')
+@click.option('--sales', default=400, help='Sales posted in total')
+@click.option('--threads', default=16, help='Concurrent cashiers')
+def check_oversell_command(stock, sales, threads):
+    """Race parallel sales for one product and fail if stock oversells or drifts"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    with app.app_context():
+        user_id, (shop_id,) = create_bench_vendor()
+        product_ids = create_bench_products(shop_id, 1, stock)
+    
+    per_thread = [sales // threads + (i < sales % threads) for i in range(threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(
+            lambda count: post_bench_sales(user_id, shop_id, product_ids, count), per_thread
+        ))
+    elapsed = time.perf_counter() - started
+    
+    statuses, latencies = merge_bench_results(results)
+    sold = statuses.get(200, 0)
+    with app.app_context():
+        failures = check_stock_conservation(product_ids, stock, sold)
+    if sold != min(stock, sales):
+        failures.append(f'{sold} sales succeeded, expected {min(stock, sales)}')
+    
+    print(f"{'❌' if failures else '✅'} {sales} sales over {threads} threads in {elapsed:.2f}s "
+          f"({sales / elapsed:.0f}/s, p50 {percentile_ms(latencies, 0.5):.1f} ms, "
+          f"p99 {percentile_ms(latencies, 0.99):.1f} ms); responses {dict(sorted(statuses.items()))}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        raise SystemExit(1)
+
 
 
 # PART 19: MAIN APPLICATION ENTRY
 
+# Servers such as `gunicorn app:app` only import the module, so start the in-process workers (and the
+# scheduler thread) here. `flask` commands manage their own: `flask worker` runs the queue, the others
+# start threads only once they enqueue a job. Deployments with JOB_WORKERS=0 run `flask worker` instead.
+if __name__ != '__main__' and os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+    start_job_workers()
 
 if __name__ == '__main__':
     # Create uploads folder if not exists
@@ -1223,15 +5014,10 @@ if __name__ == '__main__':
         os.makedirs(app.config['UPLOAD_FOLDER'])
         print("✅ Created uploads folder")
     
-    # Initialize database with error handling
-    # try:
-    #     init_db()
-    # except Exception as e:
-    #     print(f"❌ Failed to initialize database: {e}")
-    #     print("💡 If the error persists, manually delete 'vendor_app.db' and run again")
-    #     exit(1)
+    # Development server only; production workers rely on `flask init-db` / `flask migrate`
+    with app.app_context():
+        init_db()
     
     # Run application
-    
-    
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    start_job_workers()
+    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
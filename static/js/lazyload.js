@@ -1,116 +1,47 @@
-// Theme management functionality
-
-class ThemeManager {
-    constructor() {
-        this.currentTheme = this.getStoredTheme() || 'dark-blue';
-        this.init();
-    }
-
-    init() {
-        this.applyTheme(this.currentTheme);
-        this.initializeThemeToggle();
-        this.initializeSystemPreference();
-    }
-
-    getStoredTheme() {
-        try {
-            return localStorage.getItem('vendorapp-theme');
-        } catch (error) {
-            console.warn('Could not access localStorage:', error);
-            return null;
-        }
-    }
-
-    setStoredTheme(theme) {
-        try {
-            localStorage.setItem('vendorapp-theme', theme);
-        } catch (error) {
-            console.warn('Could not save theme to localStorage:', error);
-        }
-    }
-
-    applyTheme(theme) {
-        document.documentElement.setAttribute('data-theme', theme);
-        this.currentTheme = theme;
-        this.setStoredTheme(theme);
-        this.updateToggleButton(theme);
-    }
-
-    initializeThemeToggle() {
-        const toggleButton = document.getElementById('theme-toggle');
-        
-        if (toggleButton) {
-            toggleButton.addEventListener('click', () => {
-                this.toggleTheme();
+// Lazy loading for images marked with data-src (product and shop thumbnails)
+
+(function () {
+    function loadImage(img) {
+        img.src = img.dataset.src;
+        img.removeAttribute('data-src');
+        img.classList.add('lazyloaded');
+    }
+
+    const observer = 'IntersectionObserver' in window
+        ? new IntersectionObserver((entries) => {
+            entries.forEach((entry) => {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    loadImage(entry.target);
+                }
             });
-        }
-
-        this.updateToggleButton(this.currentTheme);
-    }
+        }, { rootMargin: '200px 0px' })
+        : null;
 
-    toggleTheme() {
-        const newTheme = this.currentTheme === 'dark-blue' ? 'light' : 'dark-blue';
-        this.applyTheme(newTheme);
-        
-        // Dispatch custom event for theme change
-        window.dispatchEvent(new CustomEvent('themeChanged', {
-            detail: { theme: newTheme }
-        }));
-    }
-
-    updateToggleButton(theme) {
-        const toggleButton = document.getElementById('theme-toggle');
-        if (!toggleButton) return;
-
-        const icon = toggleButton.querySelector('i');
-        if (icon) {
-            if (theme === 'dark-blue') {
-                icon.className = 'fas fa-moon';
-                toggleButton.setAttribute('aria-label', 'Switch to light theme');
+    function observeImages(root) {
+        root.querySelectorAll('img[data-src]').forEach((img) => {
+            if (observer) {
+                observer.observe(img);
             } else {
-                icon.className = 'fas fa-sun';
-                toggleButton.setAttribute('aria-label', 'Switch to dark theme');
-            }
-        }
-    }
-
-    initializeSystemPreference() {
-        // Check if user has a system preference
-        if (this.getStoredTheme()) return; // Don't override user choice
-
-        const prefersDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
-        const systemTheme = prefersDark ? 'dark-blue' : 'light';
-        
-        this.applyTheme(systemTheme);
-
-        // Listen for system theme changes
-        window.matchMedia('(prefers-color-scheme: dark)').addEventListener('change', (e) => {
-            if (!this.getStoredTheme()) { // Only auto-change if user hasn't set a preference
-                const newSystemTheme = e.matches ? 'dark-blue' : 'light';
-                this.applyTheme(newSystemTheme);
+                loadImage(img);
             }
         });
     }
 
-    // Method to get current theme
-    getCurrentTheme() {
-        return this.currentTheme;
-    }
-
-    // Method to set specific theme
-    setTheme(theme) {
-        if (['dark-blue', 'light'].includes(theme)) {
-            this.applyTheme(theme);
-        }
-    }
-}
+    document.addEventListener('DOMContentLoaded', () => {
+        observeImages(document);
 
-// Initialize theme manager when DOM is loaded
-document.addEventListener('DOMContentLoaded', () => {
-    window.themeManager = new ThemeManager();
-});
+        // Pick up cards appended later, e.g. by "load more" pagination
+        new MutationObserver((mutations) => {
+            mutations.forEach((mutation) => {
+                mutation.addedNodes.forEach((node) => {
+                    if (node.nodeType === Node.ELEMENT_NODE) {
+                        observeImages(node.matches('img[data-src]') ? node.parentNode : node);
+                    }
+                });
+            });
+        }).observe(document.body, { childList: true, subtree: true });
+    });
 
-// Export for module usage if needed
-if (typeof module !== 'undefined' && module.exports) {
-    module.exports = ThemeManager;
-}
\ No newline at end of file
+    window.observeLazyImages = observeImages;
+})();
\ No newline at end of file